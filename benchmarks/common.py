@@ -0,0 +1,60 @@
+"""
+Shared set-up of the benchmarks: a throw-away SQLite database with a seeded thread.
+
+Run the benchmarks from the repository root, e.g. `python benchmarks/post_rows.py`.
+"""
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'conf.settings')
+
+
+def setup():
+    """Configures Django against a new temporary database and returns its directory."""
+    from django.conf import settings
+    directory = tempfile.mkdtemp()
+    settings.DATABASES['default']['NAME'] = os.path.join(directory, 'benchmark.sqlite3')
+    settings.MEDIA_ROOT = directory
+    settings.DEBUG = False
+    import django
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+    return directory
+
+
+def seed_thread(posts=10000, attachment_every=10, reply_every=5):
+    from djangoboard.models import Board, Thread, Post, Attachment
+    board = Board.objects.create(name='bench')
+    thread = Thread.objects.create(board=board, comment='benchmark thread')
+    Post.objects.bulk_create([Post(thread=thread, subject='subject', comment='post %i\n>quote' % i)
+                              for i in range(posts)], batch_size=500)
+    ids = list(Post.objects.filter(thread=thread).values_list('id', flat=True))
+    Attachment.objects.bulk_create([Attachment(post=Post(id=id_), file='uploads/%i.txt' % id_, mime='text/plain')
+                                    for id_ in ids[::attachment_every]], batch_size=500)
+    Post.replies.through.objects.bulk_create([Post.replies.through(from_post_id=a, to_post_id=b)
+                                              for a, b in zip(ids[::reply_every], ids[1::reply_every])],
+                                             batch_size=500)
+    return thread
+
+
+def measure(function, repeat=3):
+    """Returns the best wall time (s) and the peak of traced allocations (bytes) of `function()`."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def report(name, seconds, peak):
+    print('%-30s %8.1f ms %10.1f MiB' % (name, seconds * 1000, peak / 2 ** 20))
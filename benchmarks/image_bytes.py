@@ -0,0 +1,64 @@
+"""Bytes a browser fetches for a thread of photos, before and after their WebP variants are made."""
+import io
+import os
+import random
+import re
+from urllib.parse import unquote
+
+from common import setup
+
+directory = setup()
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+from django.urls import reverse
+from PIL import Image
+
+from djangoboard import images
+from djangoboard.models import Board, Thread, Post, Attachment
+
+PHOTOS = 20
+
+settings.DJANGOBOARD_BACKGROUND_IMAGES = False
+random.seed(0)
+thread = Thread.objects.create(board=Board.objects.create(name='bench'), comment='benchmark thread')
+for i in range(PHOTOS):
+    # a smooth gradient with some noise, compressing about as well as a photo
+    photo = Image.linear_gradient('L').resize((1600, 1200)).convert('RGB')
+    photo = Image.blend(photo, Image.effect_noise((1600, 1200), 40).convert('RGB'), 0.3)
+    data = io.BytesIO()
+    photo.save(data, 'JPEG', quality=90)
+    post = Post.objects.create(thread=thread, comment='photo %i' % i)
+    Attachment.objects.create(post=post, file=SimpleUploadedFile('%i.jpg' % i, data.getvalue()), mime='image/jpeg')
+
+
+def size(url):
+    # files/<post id>/<digest>/<name> once the upload has a digest, MEDIA_URL + name before
+    name = url.split('/', 4)[4] if url.startswith('/files/') else url[len(settings.MEDIA_URL):]
+    return os.path.getsize(os.path.join(directory, unquote(name)))
+
+
+def page(density):
+    """Bytes of the HTML, of the pictures shown on a screen with `density` and of the linked images."""
+    html = Client().get(reverse('djangoboard:thread', args=[thread.id]), HTTP_HOST='127.0.0.1').getvalue().decode()
+    shown = 0
+    for picture in re.findall(r'<picture>(.*?)</picture>', html, re.S):
+        srcset = re.search(r'srcset="([^"]*)"', picture)
+        if srcset:
+            shown += size(srcset.group(1).split(', ')[density - 1].split()[0])
+        else:
+            shown += size(re.search(r'<img src="([^"]*)"', picture).group(1))
+    linked = sum(size(url) for url in re.findall(r'<a href="((?:/files/|%s)[^"]*)"' % settings.MEDIA_URL, html))
+    return len(html), shown, linked
+
+
+def report(name, density):
+    print('%-30s %8i B html %10i B pictures %10i B linked' % ((name,) + page(density)))
+
+
+report('original, 1x', 1)
+for attachment in Attachment.objects.all():
+    images.process(attachment)
+report('webp, 1x', 1)
+report('webp, 2x', 2)
@@ -0,0 +1,41 @@
+"""Rendering the posts of a 10k post thread with post_list_snippet.html vs. PostListRenderer."""
+from itertools import islice
+
+from common import setup, seed_thread, measure, report
+
+setup()
+
+from django.conf import settings
+from django.template.loader import get_template
+
+from djangoboard.models import Post
+from djangoboard.rendering import PostListRenderer
+from djangoboard.rows import PostRow, post_rows
+from djangoboard.templatetags.postmarkup import PostLinks, Urls
+
+thread = seed_thread()
+chunks = []
+values = Post.objects.filter(thread=thread).values_list(*PostRow.fields)
+values = iter(values)
+urls = Urls()
+while True:
+    posts, reply_threads = post_rows(islice(values, settings.DJANGOBOARD_THREAD_CHUNK_SIZE))
+    if not posts:
+        break
+    reply_threads.update((post.id, post.thread_id) for post in posts)
+    chunks.append((posts, PostLinks.resolve([post.comment for post in posts], thread.id, reply_threads, urls)))
+
+
+def template():
+    template_ = get_template('djangoboard/post_list_snippet.html')
+    return [template_.render({'posts': posts, 'post_links': post_links, 'moderation': False})
+            for posts, post_links in chunks]
+
+
+def renderer():
+    renderer_ = PostListRenderer(urls)
+    return [renderer_.render(posts, post_links, False) for posts, post_links in chunks]
+
+
+report('post_list_snippet.html', *measure(template))
+report('PostListRenderer', *measure(renderer))
@@ -0,0 +1,22 @@
+"""Loading a 10k post thread as model instances vs. as PostRows."""
+from common import setup, seed_thread, measure, report
+
+setup()
+
+from djangoboard.models import Post
+from djangoboard.rows import PostRow, post_rows
+
+thread = seed_thread()
+
+
+def models():
+    posts = list(Post.objects.filter(thread=thread).prefetch_related('attachments', 'replies'))
+    return [(post.attachments.all(), post.replies.all()) for post in posts]
+
+
+def rows():
+    return post_rows(Post.objects.filter(thread=thread).values_list(*PostRow.fields))
+
+
+report('model instances', *measure(models))
+report('PostRows', *measure(rows))
@@ -11,6 +11,10 @@ SECRET_KEY = env('SECRET_KEY')
 
 DJANGOBOARD_REQUIRE_CAPTCHA = True
 DJANGOBOARD_POSTS_PREVIEWED = 5  # number of latest posts of every thread to be shown in board view
+DJANGOBOARD_THREADS_PER_PAGE = 10  # number of threads on every page of the board API
+DJANGOBOARD_THREAD_CHUNK_SIZE = 100  # number of posts fetched and rendered at a time when streaming a thread
+DJANGOBOARD_ACTIVITY_BUCKET = 5 * 60  # seconds; granularity of the posts per hour/day shown on the homepage
+DJANGOBOARD_FAST_POST_LIST = True  # render thread posts with djangoboard.rendering instead of the template
 
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -41,6 +45,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'djangoboard.replicas.ReadYourWritesMiddleware',
 ]
 
 ROOT_URLCONF = 'conf.urls'
@@ -68,9 +73,68 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        'OPTIONS': {
+            'timeout': 20,  # seconds to wait for another process's write lock before "database is locked"
+        },
+        'TEST': {
+            # on disk rather than in memory, so that concurrent connections behave as in production
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
     }
 }
 
+# Databases threads and posts can be sharded to (see djangoboard.sharding)
+for shard in ('shard1', 'shard2'):
+    DATABASES[shard] = dict(DATABASES['default'],
+                            NAME=os.path.join(BASE_DIR, 'db.%s.sqlite3' % shard),
+                            TEST={'NAME': os.path.join(BASE_DIR, 'test_db.%s.sqlite3' % shard)})
+
+# A read-only copy of the default database (see djangoboard.replicas), the database itself in tests
+DATABASES['replica1'] = dict(DATABASES['default'],
+                             NAME=os.path.join(BASE_DIR, 'db.replica1.sqlite3'),
+                             TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['djangoboard.replicas.ReplicaRouter', 'djangoboard.sharding.ShardRouter']
+
+DJANGOBOARD_SHARDS = ['default']  # aliases holding threads and posts; never reorder once they hold posts
+DJANGOBOARD_BOARD_SHARDS = {}  # board name -> alias; other boards are on the first shard
+DJANGOBOARD_REPLICAS = {}  # alias -> aliases of its read replicas, e.g. {'default': ['replica1']}
+DJANGOBOARD_READ_YOUR_WRITES = 10  # seconds the reads of a client that posted stay on the primaries
+
+# Applied to every new SQLite connection. WAL lets readers proceed while a write is in progress.
+DJANGOBOARD_SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',  # durable in WAL mode except for the last commits on power loss
+    'cache_size': -20000,  # KiB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+
+# Seconds a user's moderated boards are cached. Revoking a permission only reaches other processes
+# through a shared cache; with the default per-process cache they keep the old permissions that long
+DJANGOBOARD_PERMISSIONS_TIMEOUT = 30
+
+# Create posts and threads on a single writer thread per process (see djangoboard.workers)
+DJANGOBOARD_SERIALIZED_WRITES = True
+
+# Static publishing (see djangoboard.publishing): when set, pages are exported to this directory
+# (run `manage.py export_static` once) and the affected ones regenerated after every change
+DJANGOBOARD_STATIC_EXPORT_ROOT = env('DJANGOBOARD_STATIC_EXPORT_ROOT', default=None)
+DJANGOBOARD_BACKGROUND_PUBLISHING = True
+
+# Process attached images on a pool of background threads (see djangoboard.images)
+DJANGOBOARD_BACKGROUND_IMAGES = True
+DJANGOBOARD_WEBP_QUALITY = 80
+
+# Header handing attachment downloads to the front-end server (see djangoboard.media):
+# 'X-Accel-Redirect' (nginx), 'X-Sendfile' (Apache's mod_xsendfile, lighttpd) or None to send them from Django
+DJANGOBOARD_SENDFILE = env('DJANGOBOARD_SENDFILE', default=None)
+DJANGOBOARD_SENDFILE_PREFIX = '/protected-media/'  # internal nginx location serving MEDIA_ROOT
+
+# Reject near-duplicates of recent posts, per board name or '*' for all boards (see djangoboard.spam), e.g.
+# {'*': {'window': 10 * 60, 'distance': 8, 'min_length': 20, 'size': 10000}}
+DJANGOBOARD_DUPLICATE_FILTER = {}
+
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
 
@@ -2,13 +2,56 @@ from django.contrib import admin
 from guardian.admin import GuardedModelAdmin
 
 from .models import *
+from .sharding import shard_of, shards
 
 
 def exterminate(modeladmin, request, queryset):
     Post.objects.filter(pseudoip__in=queryset.values_list('pseudoip', flat=True)).delete()
 
 
-class PostAdmin(admin.ModelAdmin):
+class ShardFilter(admin.SimpleListFilter):
+    """Lists the threads or posts of one shard at a time, the first one by default."""
+    title = 'shard'
+    parameter_name = 'shard'
+
+    def lookups(self, request, model_admin):
+        return [(shard, shard) for shard in shards()]
+
+    def queryset(self, request, queryset):
+        return queryset.using(self.value() or shards()[0])
+
+    def choices(self, changelist):
+        for shard, title in self.lookup_choices:
+            yield {
+                'selected': (self.value() or shards()[0]) == shard,
+                'query_string': changelist.get_query_string({self.parameter_name: shard}),
+                'display': title,
+            }
+
+
+class ShardedAdmin(admin.ModelAdmin):
+    """Finds threads and posts on their shard, and the objects related to them on the same one."""
+
+    def get_list_filter(self, request):
+        return [ShardFilter] if len(shards()) > 1 else []
+
+    def get_object(self, request, object_id, from_field=None):
+        try:
+            request.djangoboard_shard = shard_of(object_id)
+        except ValueError:
+            return None
+        return self.get_queryset(request).using(request.djangoboard_shard).filter(pk=object_id).first()
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        kwargs.setdefault('using', getattr(request, 'djangoboard_shard', None))
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        kwargs.setdefault('using', getattr(request, 'djangoboard_shard', None))
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
+
+class PostAdmin(ShardedAdmin):
     list_display = ['id', 'comment']
     ordering = ['id']
     actions = [exterminate]
@@ -18,6 +61,6 @@ class BoardAdmin(GuardedModelAdmin):
     pass
 
 
-admin.site.register(Thread)
+admin.site.register(Thread, ShardedAdmin)
 admin.site.register(Post, PostAdmin)
 admin.site.register(Board, BoardAdmin)
@@ -0,0 +1,118 @@
+"""
+Read-only JSON API.
+
+Responses are built from `.values()` rows, so no model instances are created, and carry
+strong ETags (see `utils.conditional`), so unchanged resources are answered with 304.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpRequest, HttpResponse, Http404, JsonResponse
+
+from .models import *
+from .models import media_url
+from .replicas import replica_of
+from .sharding import shard_for_board, shard_of
+from .utils import conditional, board_state, thread_state
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+POST_FIELDS = ('id', 'name', 'subject', 'comment', 'date')
+
+
+def json_response(data):
+    if orjson is not None:
+        return HttpResponse(orjson.dumps(data), content_type='application/json')
+    return JsonResponse(data, encoder=DjangoJSONEncoder, safe=False)
+
+
+def attachments_of(model, ids, using=None):
+    """Maps every post (or thread) id to the list of its attachments."""
+    attachments = {id_: [] for id_ in ids}
+    for object_id, file, mime, width, height, digest in Attachment.objects.using(using) \
+            .filter(content_type=ContentType.objects.get_for_model(model), object_id__in=ids) \
+            .values_list('object_id', 'file', 'mime', 'width', 'height', 'digest'):
+        attachments[object_id].append({'url': media_url(object_id, digest, file), 'mime': mime,
+                                       'width': width, 'height': height})
+    return attachments
+
+
+def replies_to(ids, using=None):
+    """Maps every post id to the ids of the posts replying to it."""
+    replies = {id_: [] for id_ in ids}
+    for post_id, reply_id in Post.replies.through.objects.using(using) \
+            .filter(from_post_id__in=ids) \
+            .values_list('from_post_id', 'to_post_id'):
+        replies[post_id].append(reply_id)
+    return replies
+
+
+def with_attachments(model, rows, using=None):
+    attachments = attachments_of(model, [row['id'] for row in rows], using)
+    for row in rows:
+        row['attachments'] = attachments[row['id']]
+    return rows
+
+
+def thread_rows(boardname, using):
+    return Thread.objects.using(using).filter(board=boardname).bumped() \
+        .values(*POST_FIELDS, 'num_replies', 'last_bumped')
+
+
+def boards(request: HttpRequest):
+    return json_response(list(Board.objects.using(replica_of(DEFAULT_DB_ALIAS))
+                              .values('name', 'short_description', 'description')))
+
+
+@conditional(board_state)
+def board(request: HttpRequest, boardname: str, page: int):
+    if page < 1:
+        raise Http404
+    shard = replica_of(shard_for_board(boardname))
+    if not Board.objects.using(shard).filter(name=boardname).exists():
+        raise Http404
+    per_page = settings.DJANGOBOARD_THREADS_PER_PAGE
+    threads = with_attachments(Thread, list(thread_rows(boardname, shard)[(page - 1) * per_page:page * per_page]),
+                               shard)
+    if not threads and page != 1:
+        raise Http404
+
+    posts = with_attachments(Post, list(Post.objects.using(shard).previewed()
+                                        .filter(thread_id__in=[thread['id'] for thread in threads])
+                                        .values(*POST_FIELDS, 'thread_id')), shard)
+    previews = {thread['id']: [] for thread in threads}
+    for post in posts:
+        previews[post.pop('thread_id')].append(post)
+    for thread in threads:
+        thread['posts'] = previews[thread['id']]
+    return json_response({'board': boardname, 'page': page, 'threads': threads})
+
+
+@conditional(board_state)
+def catalog(request: HttpRequest, boardname: str):
+    shard = replica_of(shard_for_board(boardname))
+    if not Board.objects.using(shard).filter(name=boardname).exists():
+        raise Http404
+    return json_response({'board': boardname,
+                          'threads': with_attachments(Thread, list(thread_rows(boardname, shard)), shard)})
+
+
+@conditional(thread_state)
+def thread(request: HttpRequest, thread_id: int):
+    shard = replica_of(shard_of(thread_id))
+    thread_ = Thread.objects.using(shard).filter(id=thread_id).values(*POST_FIELDS, 'board').first()
+    if thread_ is None:
+        raise Http404
+    thread_['attachments'] = attachments_of(Thread, [thread_id], shard)[thread_id]
+
+    posts = with_attachments(Post, list(Post.objects.using(shard).filter(thread_id=thread_id).values(*POST_FIELDS)),
+                             shard)
+    replies = replies_to([post['id'] for post in posts], shard)
+    for post in posts:
+        post['replies'] = replies[post['id']]
+    thread_['posts'] = posts
+    return json_response(thread_)
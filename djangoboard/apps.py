@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class DjangoboardConfig(AppConfig):
     name = 'djangoboard'
+
+    def ready(self):
+        from . import signals  # connects the receivers
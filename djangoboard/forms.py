@@ -1,8 +1,11 @@
 from captcha.fields import CaptchaField
 from django import forms
+from django.db import transaction
 from django.utils.datastructures import MultiValueDict
 
+from . import images, media, spam
 from .models import *
+from .sharding import shard_of
 from .templatetags.postmarkup import find_all_replies
 
 __all__ = ['PostForm', 'ThreadForm', 'CaptchaForm']
@@ -12,21 +15,55 @@ class CaptchaForm(forms.Form):
     captcha = CaptchaField()
 
 
+class ThreadChoiceField(forms.ModelChoiceField):
+    """Looks threads up on their shard rather than on the default database."""
+
+    def to_python(self, value):
+        if value in self.empty_values:
+            return None
+        try:
+            return self.queryset.using(shard_of(value)).get(id=value)
+        except (ValueError, TypeError, self.queryset.model.DoesNotExist):
+            raise forms.ValidationError(self.error_messages['invalid_choice'], code='invalid_choice')
+
+
 class AbstractPostForm(forms.ModelForm):
+    fingerprints = ()
+    digests = ()  # of the attachments, in order
+
+    @property
+    def board_name(self):
+        """Name of the board of the post, from its cleaned data; None if it isn't valid."""
+        return None
+
     def clean(self):
         cleaned_data = super().clean()
         if not cleaned_data.get('comment') and not cleaned_data.get('attachments_'):
             raise forms.ValidationError("Post is empty")
 
-        if len(MultiValueDict(self.files).getlist('attachments_')) > 2:
+        files = MultiValueDict(self.files).getlist('attachments_')
+        if len(files) > 2:
             raise forms.ValidationError("Too many attachments")
 
+        # read once, for the duplicate filter and the URLs of the attachments
+        self.digests = [media.digest(file.chunks()) for file in files]
+        if self.board_name and not self.errors:
+            self.fingerprints = spam.fingerprints(self.board_name, cleaned_data.get('comment'), self.digests)
+            if spam.is_duplicate(self.fingerprints):
+                raise forms.ValidationError("This post repeats a recent one")
+
     def save(self):
         post = super().save()
         # post.save()
+        fingerprints = self.fingerprints
+        transaction.on_commit(lambda: spam.remember(fingerprints), using=post._state.db)
 
-        Attachment.objects.bulk_create(
-            [Attachment(post=post, file=file, mime=file.content_type) for file in self.files.getlist('attachments_')])
+        files = self.files.getlist('attachments_')
+        if files:
+            Attachment.objects.using(post._state.db).bulk_create(
+                [Attachment(post=post, file=file, mime=file.content_type, digest=digest)
+                 for file, digest in zip(files, self.digests)])
+            images.schedule(post)
 
         return post
 
@@ -39,13 +76,20 @@ class PostForm(AbstractPostForm):
 
         fields = ['name', 'thread', 'subject', 'comment', 'thread', 'attachments_']
         widgets = {'thread': forms.HiddenInput(), 'comment': forms.Textarea()}
+        field_classes = {'thread': ThreadChoiceField}
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    @property
+    def board_name(self):
+        thread = self.cleaned_data.get('thread')
+        return thread and thread.board_id
+
     def save(self):
         post = super().save()
-        post.replies_to.add(*Post.objects.filter(id__in=find_all_replies(post.comment)))
+        # only posts on the same shard can be related, replies to other boards are just links
+        post.replies_to.add(*Post.objects.using(post._state.db).filter(id__in=find_all_replies(post.comment)))
         return post
 
 
@@ -57,3 +101,8 @@ class ThreadForm(AbstractPostForm):
 
         fields = ['name', 'subject', 'comment', 'board', 'attachments_']
         widgets = {'comment': forms.Textarea(), 'board': forms.HiddenInput()}
+
+    @property
+    def board_name(self):
+        board = self.cleaned_data.get('board')
+        return board and board.name
@@ -0,0 +1,131 @@
+"""
+Bandwidth-efficient variants of attached images.
+
+Once a post is committed, its images are processed on a pool of background threads:
+
+- metadata (EXIF, with the camera, location...) is stripped from the original, which is turned
+  upright first if it was only rotated by its EXIF orientation; JPEGs that need no turning keep
+  their compressed data, and images without metadata are not rewritten at all,
+- its dimensions are stored on the Attachment,
+- WebP variants are saved beside the original as `<upload>.<suffix>`: square thumbnails for
+  one and two device pixels per CSS pixel (`t100.webp`, `t200.webp`) and the full image
+  (`webp`), which is only kept if it is smaller than the original.
+
+The suffixes made are listed in `Attachment.variants`; templates fall back to the original
+and to easy_thumbnails' JPEG thumbnail for anything that has not been processed (yet).
+The URLs of the original stay the same (see djangoboard.media); the `version` of the thread
+and of its board is bumped so that their validators change, and statically published pages
+of the post are regenerated afterwards with the variants.
+"""
+import io
+import logging
+import os
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import F
+from PIL import ExifTags, Image, ImageOps
+
+from . import publishing
+from .models import *
+from .workers import Worker
+
+__all__ = ['process', 'process_post', 'schedule', 'processor']
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZE = 100  # CSS pixels, as in attachments_snippet.html
+
+# Pillow releases the GIL while decoding, resizing and encoding, so threads do run in parallel
+processor = Worker('DJANGOBOARD_BACKGROUND_IMAGES', max_workers=os.cpu_count() or 1)
+
+
+def webp(image):
+    data = io.BytesIO()
+    image.save(data, 'WEBP', quality=settings.DJANGOBOARD_WEBP_QUALITY, method=4,
+               icc_profile=image.info.get('icc_profile'))
+    return data.getvalue()
+
+
+def replace(storage, name, content):
+    # atomically, so the file is never missing or partly written
+    publishing.write(storage.path(name), content)
+
+
+def process(attachment):
+    """Strips the metadata of an image attachment, stores its dimensions and makes its variants."""
+    storage = attachment.file.storage
+    with storage.open(attachment.file.name) as f:
+        original = f.read()
+    image = Image.open(io.BytesIO(original))
+    attachments = Attachment.objects.using(attachment._state.db).filter(id=attachment.id)
+    if getattr(image, 'is_animated', False):
+        attachments.update(width=image.width, height=image.height)
+        return
+
+    exif = image.getexif()
+    # exif_transpose copies images that have no orientation, so only call it for those that do
+    rotated = exif.get(ExifTags.Base.Orientation, 1) != 1
+    upright = ImageOps.exif_transpose(image) if rotated else image
+    if exif or 'xmp' in image.info:
+        # saved without the metadata, but with the colour profile; files without any are left as they are
+        stripped = io.BytesIO()
+        icc_profile = image.info.get('icc_profile')
+        if image.format == 'JPEG' and not rotated:
+            image.save(stripped, 'JPEG', quality='keep', icc_profile=icc_profile)  # with its own quantization
+        elif image.format in ('JPEG', 'WEBP'):
+            upright.save(stripped, image.format, quality=90, icc_profile=icc_profile)
+        elif image.format == 'PNG':
+            upright.save(stripped, 'PNG', icc_profile=icc_profile)
+        else:
+            stripped = None
+        if stripped is not None:
+            original = stripped.getvalue()
+            replace(storage, attachment.file.name, original)
+    image = upright
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+
+    variants = []
+    for scale in (1, 2):
+        size = THUMBNAIL_SIZE * scale
+        if scale == 1 or min(image.size) >= size:
+            thumbnail = ImageOps.fit(image, (min(size, image.width), min(size, image.height)), Image.LANCZOS)
+            replace(storage, '%s.t%i.webp' % (attachment.file.name, size), webp(thumbnail))
+            variants.append('t%i.webp' % size)
+    full = webp(image)
+    if len(full) < len(original):
+        replace(storage, '%s.webp' % attachment.file.name, full)
+        variants.append('webp')
+
+    attachments.update(width=image.width, height=image.height, variants=' '.join(variants))
+
+
+def process_post(model, object_id, using):
+    """Processes the image attachments of a post (or thread)."""
+    processed = False
+    for attachment in Attachment.objects.using(using).filter(content_type=ContentType.objects.get_for_model(model),
+                                                             object_id=object_id, mime__startswith='image'):
+        try:
+            process(attachment)
+            processed = True
+        except Exception:
+            # the originals are still served, posting must not fail because of this
+            logger.exception('Could not process attachment %s', attachment.id)
+    thread = Thread.objects.using(using).filter(**{'id' if model is Thread else 'posts': object_id}) \
+        .values_list('id', 'board').first()
+    if not processed or thread is None:
+        return
+    thread_id, board = thread
+    # new validators for the pages of the thread and its board, which now link to the variants
+    Thread.objects.using(using).filter(id=thread_id).update(version=F('version') + 1)
+    Board.objects.filter(name=board).update(version=F('version') + 1)
+    if settings.DJANGOBOARD_STATIC_EXPORT_ROOT:
+        publishing.schedule(publishing.publish_thread, thread_id)
+
+
+def schedule(post):
+    """Processes the images of `post` in the background once it is committed."""
+    transaction.on_commit(lambda: processor.submit(process_post, type(post), post.id, post._state.db),
+                          using=post._state.db)
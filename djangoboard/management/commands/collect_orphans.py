@@ -0,0 +1,99 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+from easy_thumbnails.models import Source, Thumbnail
+
+from djangoboard.media import candidates, keeps, thumbnails
+from djangoboard.models import Attachment
+from djangoboard.sharding import shards
+
+QUERY_SIZE = 500  # names per query, below SQLite's limit on query parameters
+
+
+def walk(directory):
+    """Files under `directory`, listed one directory at a time."""
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                yield from walk(entry.path)
+            elif entry.is_file(follow_symlinks=False):
+                yield entry
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def referenced(names):
+    """The variants of those of `names` that are attachments, on any shard, by name."""
+    found = {}
+    for shard in shards():
+        for batch in batches(names, QUERY_SIZE):
+            found.update(Attachment.objects.using(shard).filter(file__in=batch).values_list('file', 'variants'))
+    return found
+
+
+def recorded_thumbnails(names):
+    found = set()
+    for batch in batches(names, QUERY_SIZE):
+        found.update(thumbnails(batch))
+    return found
+
+
+class Command(BaseCommand):
+    help = 'Deletes uploaded files and thumbnails that no attachment refers to anymore.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report the orphaned files')
+        parser.add_argument('--min-age', type=int, default=60 * 60,
+                            help='Seconds since a file was last modified before it can be deleted (default: 3600). '
+                                 'Uploads are written before their attachment is committed.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Files checked and deleted at a time')
+        parser.add_argument('--rate', type=float, default=100,
+                            help='Files deleted per second at most, 0 for no limit (default: 100)')
+
+    def handle(self, *args, dry_run, min_age, batch_size, rate, **options):
+        field = Attachment._meta.get_field('file')
+        root = field.storage.location
+        directory = os.path.join(root, field.upload_to)
+        if not os.path.isdir(directory):
+            self.stdout.write('Nothing to collect in %s' % directory)
+            return
+
+        deadline = time.time() - min_age
+        orphans = size = 0
+        for batch in batches(walk(directory), batch_size):
+            names = {entry: os.path.relpath(entry.path, root).replace(os.sep, '/') for entry in batch}
+            kept = referenced({candidate for name in names.values() for candidate in candidates(name)})
+            thumbnails_ = recorded_thumbnails(names.values())
+
+            collected = []
+            for entry, name in names.items():
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < deadline and not any(keeps(upload, kept[upload], name, thumbnails_)
+                                                          for upload in candidates(name) if upload in kept):
+                    collected.append(name)
+                    size += stat.st_size
+                    if options['verbosity'] > 1:
+                        self.stdout.write(name)
+                    if not dry_run:
+                        os.remove(entry.path)
+            orphans += len(collected)
+
+            if collected and not dry_run:
+                for names_ in batches(collected, QUERY_SIZE):
+                    # deleting a source deletes the records of its thumbnails
+                    Source.objects.filter(name__in=names_).delete()
+                    Thumbnail.objects.filter(name__in=names_).delete()
+                if rate:
+                    time.sleep(len(collected) / rate)
+
+        self.stdout.write('%s %i orphaned files, %i bytes' % ('Found' if dry_run else 'Deleted', orphans, size))
@@ -0,0 +1,18 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from djangoboard.publishing import publish_all
+
+
+class Command(BaseCommand):
+    help = 'Renders the homepage, every board and every thread to static HTML files.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--root', default=settings.DJANGOBOARD_STATIC_EXPORT_ROOT,
+                            help='Directory to write to (DJANGOBOARD_STATIC_EXPORT_ROOT by default)')
+
+    def handle(self, *args, root, **options):
+        if not root:
+            raise CommandError('Set DJANGOBOARD_STATIC_EXPORT_ROOT or pass --root')
+        publish_all(root)
+        self.stdout.write('Exported to %s' % root)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from djangoboard.images import process
+from djangoboard.models import Attachment
+from djangoboard.sharding import shards
+
+
+class Command(BaseCommand):
+    help = 'Strips the metadata of image attachments that were never processed and makes their WebP variants.'
+
+    def handle(self, *args, **options):
+        processed = failed = 0
+        for shard in shards():
+            for attachment in Attachment.objects.using(shard).filter(mime__startswith='image', width=None).iterator():
+                try:
+                    process(attachment)
+                    processed += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write('%s: %s' % (attachment.file.name, e))
+        self.stdout.write('Processed %i images, %i failed' % (processed, failed))
@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = 'Copies every SQLite database in DJANGOBOARD_REPLICAS to its replicas, for local setups.'
+
+    def handle(self, *args, **options):
+        if not settings.DJANGOBOARD_REPLICAS:
+            raise CommandError('DJANGOBOARD_REPLICAS is empty')
+        for primary, replicas in settings.DJANGOBOARD_REPLICAS.items():
+            for replica in replicas:
+                if connections[primary].vendor != 'sqlite' or connections[replica].vendor != 'sqlite':
+                    raise CommandError('%s and %s are not both SQLite databases' % (primary, replica))
+                connections[primary].ensure_connection()
+                connections[replica].ensure_connection()
+                # a consistent snapshot, taken page by page without blocking writers for long
+                connections[primary].connection.backup(connections[replica].connection)
+                self.stdout.write('Copied %s to %s' % (primary, replica))
@@ -0,0 +1,110 @@
+"""
+Delivery of attachments, their thumbnails and variants.
+
+They are linked as `files/<post id>/<digest>/<name>`, where the digest is a hash of the
+file as it was uploaded. A new upload gets new URLs, so responses are cached for a year as
+immutable, without browsers or CDNs ever revalidating them. The one change an upload goes
+through, djangoboard.images stripping its metadata, keeps its URLs so that pages already
+served stay valid: images are served with `no-cache` until they are processed, and only the
+stripped images and their thumbnails are cached for good.
+
+`serve` checks that the post still has an attachment with this digest, with one indexed
+query on the post's shard (and one more for easy_thumbnails' thumbnails), then hands the transfer to the front-end server, so Python never
+streams the file. DJANGOBOARD_SENDFILE names the header it understands:
+
+- 'X-Accel-Redirect' for nginx, pointing into DJANGOBOARD_SENDFILE_PREFIX, an internal
+  location serving MEDIA_ROOT:
+
+      location /protected-media/ {
+          internal;
+          alias /path/to/media/;
+      }
+
+- 'X-Sendfile' for Apache's mod_xsendfile or lighttpd, with the file's absolute path,
+- None to send the file from Django, for development.
+
+Files of deleted posts are refused from then on, but copies already in caches are not purged.
+"""
+import hashlib
+import mimetypes
+import posixpath
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+from django.utils.cache import patch_cache_control
+from django.views import static
+from django.views.decorators.http import require_safe
+from easy_thumbnails.models import Thumbnail
+from easy_thumbnails.utils import get_storage_hash
+
+from .models import *
+from .replicas import replica_of
+from .sharding import shard_of
+
+__all__ = ['digest', 'candidates', 'thumbnails', 'keeps', 'serve']
+
+MAX_AGE = 365 * 24 * 60 * 60
+
+
+def digest(chunks):
+    """The digest of an upload, from its content in chunks of bytes."""
+    hash_ = hashlib.blake2b(digest_size=8)
+    for chunk in chunks:
+        hash_.update(chunk)
+    return hash_.hexdigest()
+
+
+def candidates(name):
+    """The names of the uploads the file `name` could be or derive from: itself and the names it extends after a dot."""
+    parts = name.split('.')
+    return ['.'.join(parts[:i]) for i in range(1, len(parts) + 1)]
+
+
+def thumbnails(names):
+    """The (name, source name) pairs of those of `names` that easy_thumbnails made from an upload."""
+    storage_hash = get_storage_hash(Attachment._meta.get_field('file').storage)
+    return set(Thumbnail.objects.filter(source__storage_hash=storage_hash, name__in=names)
+               .values_list('name', 'source__name'))
+
+
+def keeps(upload, variants, name, thumbnails_):
+    """
+    Whether the attachment `upload`, with its `variants`, keeps the file `name`: the upload itself,
+    one of the variants djangoboard.images made or one of the `thumbnails_` recorded for it.
+    Other names merely extending it may be left by deleted attachments.
+    """
+    return name == upload or name.startswith(upload + '.') and (
+        name[len(upload) + 1:] in variants.split() or (name, upload) in thumbnails_)
+
+
+@require_safe
+def serve(request, object_id, digest, name):
+    # `uploads/a.jpg./../b.jpg` extends `uploads/a.jpg` but is another file
+    if posixpath.normpath(name) != name or name.startswith('/'):
+        raise Http404
+    attachments = list(Attachment.objects.using(replica_of(shard_of(object_id)))
+                       .filter(digest=digest, object_id=object_id, file__in=candidates(name))
+                       .values_list('file', 'variants', 'mime', 'width'))
+    kept = [attachment for attachment in attachments if keeps(attachment[0], attachment[1], name, ())]
+    if not kept and attachments:  # maybe one of their thumbnails
+        thumbnails_ = thumbnails([name])
+        kept = [attachment for attachment in attachments if keeps(attachment[0], attachment[1], name, thumbnails_)]
+    if not kept:
+        raise Http404
+    _, _, mime, width = kept[0]
+
+    storage = Attachment._meta.get_field('file').storage
+    if settings.DJANGOBOARD_SENDFILE is None:
+        response = static.serve(request, name, document_root=storage.location)
+    else:
+        response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        if settings.DJANGOBOARD_SENDFILE == 'X-Accel-Redirect':
+            response['X-Accel-Redirect'] = settings.DJANGOBOARD_SENDFILE_PREFIX + quote(name)
+        else:
+            response[settings.DJANGOBOARD_SENDFILE] = storage.path(name)
+    if mime.startswith('image') and width is None:  # not processed (yet)
+        patch_cache_control(response, no_cache=True)
+    else:
+        patch_cache_control(response, public=True, max_age=MAX_AGE, immutable=True)
+    return response
@@ -0,0 +1,77 @@
+# Generated by Django 3.2.18 on 2026-10-19 15:46
+
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Count, Max
+from django.utils import timezone
+
+
+def bucket(date):
+    # as djangoboard.stats.bucket when this migration was written
+    timestamp = date.timestamp()
+    return datetime.fromtimestamp(timestamp - timestamp % settings.DJANGOBOARD_ACTIVITY_BUCKET, timezone.utc)
+
+
+def count_posts(apps, schema_editor):
+    Board = apps.get_model('djangoboard', 'Board')
+    BoardActivity = apps.get_model('djangoboard', 'BoardActivity')
+    Thread = apps.get_model('djangoboard', 'Thread')
+    Post = apps.get_model('djangoboard', 'Post')
+    db = schema_editor.connection.alias
+    since = timezone.now() - timedelta(days=1)
+
+    for board in Board.objects.using(db):
+        threads = Thread.objects.using(db).filter(board=board).aggregate(count=Count('id'), last=Max('date'))
+        posts = Post.objects.using(db).filter(thread__board=board).aggregate(count=Count('id'), last=Max('date'))
+        board.thread_count = threads['count']
+        board.post_count = threads['count'] + posts['count']
+        board.last_activity = max(filter(None, (threads['last'], posts['last'])), default=None)
+        board.save(using=db)
+
+        activity = {}
+        for model, board_filter in ((Thread, {'board': board}), (Post, {'thread__board': board})):
+            for date in model.objects.using(db).filter(date__gt=since, **board_filter).values_list('date', flat=True):
+                activity[bucket(date)] = activity.get(bucket(date), 0) + 1
+        BoardActivity.objects.using(db).bulk_create(
+            [BoardActivity(board=board, start=start, posts=posts) for start, posts in activity.items()])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoboard', '0002_auto_20190304_1230'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='last_activity',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='post_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='board',
+            name='thread_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.CreateModel(
+            name='BoardActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('posts', models.PositiveIntegerField(default=0)),
+                ('board', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='djangoboard.board')),
+            ],
+            options={
+                'unique_together': {('board', 'start')},
+            },
+        ),
+        migrations.RunPython(count_posts, migrations.RunPython.noop),
+    ]
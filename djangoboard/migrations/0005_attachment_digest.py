@@ -0,0 +1,41 @@
+# Generated by Django 3.2.18 on 2026-10-19 16:08
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def digest(chunks):
+    # as djangoboard.media.digest when this migration was written
+    hash_ = hashlib.blake2b(digest_size=8)
+    for chunk in chunks:
+        hash_.update(chunk)
+    return hash_.hexdigest()
+
+
+def digest_uploads(apps, schema_editor):
+    Attachment = apps.get_model('djangoboard', 'Attachment')
+    db = schema_editor.connection.alias
+    for attachment in Attachment.objects.using(db).exclude(file='').iterator():
+        try:
+            with attachment.file.open('rb') as f:
+                attachment.digest = digest(f.chunks())
+        except OSError:
+            continue  # missing upload, its URLs stay unversioned
+        attachment.save(using=db, update_fields=['digest'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoboard', '0004_attachment_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='attachment',
+            name='digest',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16),
+        ),
+        migrations.RunPython(digest_uploads, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.2.18 on 2026-10-19 16:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoboard', '0005_attachment_digest'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdSequence',
+            fields=[
+                ('table', models.CharField(max_length=100, primary_key=True, serialize=False)),
+                ('last', models.BigIntegerField()),
+            ],
+        ),
+    ]
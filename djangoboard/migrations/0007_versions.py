@@ -0,0 +1,23 @@
+# Generated by Django 3.2.18 on 2026-10-19 16:34
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('djangoboard', '0006_id_sequence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='board',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
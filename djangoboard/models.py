@@ -1,10 +1,17 @@
+from functools import lru_cache
+from urllib.parse import quote
+
 from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.db import models
-from django.urls import reverse
+from django.db.models import Count, Max, Subquery, OuterRef, Case, When
+from django.urls import get_script_prefix, reverse
 from django.utils import timezone
+from django.utils.http import RFC3986_SUBDELIMS
+from easy_thumbnails.files import get_thumbnailer
 
-__all__ = ['Board', 'Post', 'Thread', 'Attachment']
+__all__ = ['Board', 'BoardActivity', 'IdSequence', 'Post', 'Thread', 'Attachment']
 
 
 class Board(models.Model):
@@ -12,6 +19,13 @@ class Board(models.Model):
     short_description = models.CharField(max_length=20, blank=True)
     description = models.CharField(max_length=500, blank=True)
 
+    # maintained on every write by djangoboard.stats
+    thread_count = models.PositiveIntegerField(default=0, editable=False)
+    post_count = models.PositiveIntegerField(default=0, editable=False)  # including opening posts
+    last_activity = models.DateTimeField(null=True, blank=True, editable=False)
+    # bumped by djangoboard.images once the attachments of a post on the board are processed
+    version = models.PositiveIntegerField(default=0, editable=False)
+
     class Meta:
         permissions = (
             ('delete_posts', 'Delete posts'),
@@ -22,6 +36,28 @@ class Board(models.Model):
         return self.name
 
 
+class BoardActivity(models.Model):
+    """Number of posts made on a board in the DJANGOBOARD_ACTIVITY_BUCKET seconds from `start`."""
+    board = models.ForeignKey('Board', on_delete=models.CASCADE, related_name='activity')
+    start = models.DateTimeField()
+    posts = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('board', 'start')
+
+    def __str__(self):
+        return '%s:%s:%i' % (self.board_id, self.start, self.posts)
+
+
+class IdSequence(models.Model):
+    """The last id a shard allocated to the rows of a table (see djangoboard.sharding)."""
+    table = models.CharField(max_length=100, primary_key=True)
+    last = models.BigIntegerField()
+
+    def __str__(self):
+        return '%s:%i' % (self.table, self.last)
+
+
 class AbstractPost(models.Model):
     name = models.CharField(max_length=40, default='Anonymous', blank=True)
     subject = models.CharField(max_length=100, blank=True)
@@ -32,11 +68,21 @@ class AbstractPost(models.Model):
         abstract = True
 
 
+class PostQuerySet(models.QuerySet):
+    def previewed(self):
+        """Only the few posts of every thread that are displayed on board pages."""
+        return self.filter(id__in=Subquery(
+            Post.objects.filter(thread_id=OuterRef('thread_id'))
+                .values_list('id', flat=True)[:settings.DJANGOBOARD_POSTS_PREVIEWED]))
+
+
 class Post(AbstractPost):
     thread = models.ForeignKey('Thread', on_delete=models.CASCADE, related_name='posts')
     replies = models.ManyToManyField('self', blank=True, symmetrical=False, related_name='replies_to')
     attachments = GenericRelation('Attachment')
 
+    objects = PostQuerySet.as_manager()
+
     class Meta:
         ordering = ['date']
 
@@ -49,9 +95,23 @@ class Post(AbstractPost):
         return '%i:%s' % (self.id, self.comment[:15])
 
 
+class ThreadQuerySet(models.QuerySet):
+    def bumped(self):
+        """Threads annotated with their number of replies, most recently bumped first."""
+        return self.annotate(num_replies=Count('posts')) \
+            .annotate(last_bumped=Case(
+                When(num_replies=0, then='date'),
+                When(num_replies__gt=0, then=Max('posts__date')))) \
+            .order_by('-last_bumped')
+
+
 class Thread(AbstractPost):
     board = models.ForeignKey('Board', on_delete=models.CASCADE, related_name='threads')
     attachments = GenericRelation('Attachment')
+    # bumped by djangoboard.images once the attachments of the thread or a post of it are processed
+    version = models.PositiveIntegerField(default=0, editable=False)
+
+    objects = ThreadQuerySet.as_manager()
 
     def get_absolute_url(self):
         return reverse('djangoboard:thread', args=[self.id])
@@ -60,10 +120,71 @@ class Thread(AbstractPost):
         return '%i:%s' % (self.id, self.comment[:15])
 
 
-class Attachment(models.Model):
+@lru_cache()
+def media_prefix(script_prefix):
+    # reverse() run once rather than for every attachment and variant
+    return reverse('djangoboard:media', args=[0, 'digest', 'name'])[:-len('0/digest/name')]
+
+
+def media_url(object_id, digest, name):
+    """
+    URL of the upload `name` of an attachment of post (or thread) `object_id`, or of one of its
+    derivatives, versioned by the `digest` of the upload (see djangoboard.media).
+    """
+    if not digest:  # uploaded before digests, or never saved through a form
+        return Attachment._meta.get_field('file').storage.url(name)
+    # quoted like reverse() quotes its arguments
+    return '%s%i/%s/%s' % (media_prefix(get_script_prefix()), object_id, digest,
+                           quote(name, safe=RFC3986_SUBDELIMS + '/~:@'))
+
+
+class ImageVariants:
+    """
+    Links to an attachment with a `file`, `object_id` and `digest`, and to the variants
+    djangoboard.images makes of it (its `variants`).
+    """
+    thumbnail_options = {'size': (100, 100), 'crop': True}
+
+    def variant_url(self, suffix):
+        return media_url(self.object_id, self.digest, '%s.%s' % (self.file.name, suffix))
+
+    @property
+    def url(self):
+        return media_url(self.object_id, self.digest, self.file.name)
+
+    @property
+    def href(self):
+        """What the attachment links to: the WebP image when it is smaller, the original otherwise."""
+        return self.variant_url('webp') if 'webp' in self.variants.split() else self.url
+
+    @property
+    def thumbnail_url(self):
+        # like {% thumbnail %}, which renders nothing if the thumbnail can't be made
+        try:
+            thumbnail = get_thumbnailer(self.file).get_thumbnail(self.thumbnail_options)
+        except Exception:
+            return ''
+        return media_url(self.object_id, self.digest, thumbnail.name)
+
+    @property
+    def thumbnail_srcset(self):
+        """The `srcset` of the WebP thumbnails, empty if there are none."""
+        variants = self.variants.split()
+        return ', '.join('%s %s' % (self.variant_url(suffix), density)
+                         for suffix, density in (('t100.webp', '1x'), ('t200.webp', '2x')) if suffix in variants)
+
+
+class Attachment(ImageVariants, models.Model):
     file = models.FileField(blank=True, upload_to='uploads')
     mime = models.CharField(max_length=10, blank=True)
 
+    # filled in by djangoboard.images
+    width = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    height = models.PositiveIntegerField(null=True, blank=True, editable=False)
+    variants = models.CharField(max_length=100, blank=True, editable=False)
+    # hash of the uploaded file, versioning its URLs
+    digest = models.CharField(max_length=16, blank=True, db_index=True, editable=False)
+
     content_type = models.ForeignKey(ContentType, related_name="content_type_attachments", on_delete=models.CASCADE)
     object_id = models.PositiveIntegerField()
     post = GenericForeignKey('content_type', 'object_id')
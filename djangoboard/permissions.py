@@ -0,0 +1,68 @@
+"""
+Cached moderator permissions.
+
+The boards a user may delete posts on are looked up in guardian's tables once, then kept in the
+Django cache (and on the user object for the rest of the request). Every cached set is tagged
+with a generation that is replaced whenever an object permission, a group membership or a user
+changes, which invalidates the sets of all users at once.
+
+Invalidation only reaches other processes through a cache they share (Memcached, Redis, a
+database or file cache). With a per-process cache such as the default LocMemCache, the other
+processes keep a user's set for up to DJANGOBOARD_PERMISSIONS_TIMEOUT seconds: a revoked
+moderator can keep deleting posts that long. `manage.py check --deploy` warns about them.
+"""
+import uuid
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from guardian.shortcuts import get_objects_for_user
+
+from .models import *
+
+__all__ = ['moderated_boards', 'can_moderate', 'invalidate']
+
+GENERATION_KEY = 'djangoboard:permissions'
+
+
+def moderated_boards(user):
+    """Names of the boards `user` can delete posts on."""
+    if not (user.is_authenticated and user.is_active):
+        return frozenset()
+    try:
+        return user._djangoboard_moderated
+    except AttributeError:
+        pass
+    generation = cache.get_or_set(GENERATION_KEY, lambda: uuid.uuid4().hex, None)
+    key = 'djangoboard:moderated:%s:%s' % (user.pk, generation)
+    boards = cache.get(key)
+    if boards is None:
+        # like user.has_perm(), which only looks at the permissions on the object itself
+        boards = frozenset(get_objects_for_user(user, 'delete_posts', Board, accept_global_perms=False)
+                           .values_list('name', flat=True))
+        cache.set(key, boards, settings.DJANGOBOARD_PERMISSIONS_TIMEOUT)
+    user._djangoboard_moderated = boards
+    return boards
+
+
+def can_moderate(user, boardname):
+    return boardname in moderated_boards(user)
+
+
+def invalidate():
+    # right away for this process, and again once the change is visible to the others
+    cache.delete(GENERATION_KEY)
+    transaction.on_commit(lambda: cache.delete(GENERATION_KEY))
+
+
+@checks.register(checks.Tags.caches, deploy=True)
+def check_shared_cache(app_configs, **kwargs):
+    if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+        return [checks.Warning(
+            'The default cache is local to every process, so revoked moderator permissions stay '
+            'in effect in the other processes for up to DJANGOBOARD_PERMISSIONS_TIMEOUT seconds.',
+            hint='Use a cache shared by all processes, such as Memcached or Redis.',
+            id='djangoboard.W001')]
+    return []
@@ -0,0 +1,112 @@
+"""
+Static publishing: pages rendered to DJANGOBOARD_STATIC_EXPORT_ROOT for the front-end server to serve.
+
+A page for the URL /b is written to <root>/b/index.html, /thread/1 to <root>/thread/1/index.html.
+Pages are rendered as for an anonymous visitor and replaced atomically, so readers never see
+partially written files.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.http import Http404, HttpRequest
+from django.urls import reverse, resolve
+
+from .models import *
+from .replicas import primary
+from .sharding import shard_of, shards
+from .workers import Worker
+
+__all__ = ['publish', 'publish_thread', 'publish_all', 'schedule']
+
+logger = logging.getLogger(__name__)
+
+publisher = Worker('DJANGOBOARD_BACKGROUND_PUBLISHING')
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def path_for(url, root=None):
+    return os.path.join(root or settings.DJANGOBOARD_STATIC_EXPORT_ROOT, url.lstrip('/'), 'index.html')
+
+
+def render(url):
+    """Returns the page at `url` as an anonymous visitor would get it, or None if there is no such page."""
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = url
+    request.META = {'SERVER_NAME': settings.ALLOWED_HOSTS[0], 'SERVER_PORT': '80'}
+    request.user = AnonymousUser()
+    request.session = {}
+
+    match = resolve(url)
+    # pages are published right after the change, which replicas may not have yet
+    with primary():
+        try:
+            response = match.func(request, *match.args, **match.kwargs)
+        except Http404:
+            return None
+        if response.status_code != 200:
+            return None
+        if hasattr(response, 'render'):
+            response.render()
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+
+def write(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path), delete=False) as f:
+        f.write(content)
+    os.chmod(f.name, 0o644)
+    os.replace(f.name, path)
+
+
+def publish(url, root=None):
+    """Renders the page at `url` into the export directory, or removes it if the page no longer exists."""
+    path = path_for(url, root)
+    content = render(url)
+    if content is not None:
+        write(path, content)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def publish_thread(thread_id, root=None):
+    """Regenerates a thread and the page of its board."""
+    publish(reverse('djangoboard:thread', args=[thread_id]), root)
+    board = Thread.objects.using(shard_of(thread_id)).filter(id=thread_id).values_list('board', flat=True).first()
+    if board is not None:
+        publish(reverse('djangoboard:board', args=[board]), root)
+
+
+def publish_all(root=None):
+    publish(reverse('djangoboard:homepage'), root)
+    for name in Board.objects.values_list('name', flat=True).iterator():
+        publish(reverse('djangoboard:board', args=[name]), root)
+    for shard in shards():
+        for id_ in Thread.objects.using(shard).values_list('id', flat=True).iterator():
+            publish(reverse('djangoboard:thread', args=[id_]), root)
+
+
+def _run_pending(job):
+    with _pending_lock:
+        _pending.discard(job)
+    function, *args = job
+    try:
+        function(*args)
+    except Exception:
+        # the next change to the page will regenerate it, posting must not fail because of this
+        logger.exception('Could not publish %s%r', function.__name__, tuple(args))
+
+
+def schedule(function, *args):
+    """Runs `function(*args)` in the background, unless the same call is already waiting to run."""
+    job = (function, *args)
+    with _pending_lock:
+        if job in _pending:
+            return
+        _pending.add(job)
+    publisher.submit(_run_pending, job)
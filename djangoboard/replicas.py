@@ -0,0 +1,90 @@
+"""
+Read replicas for the board, thread, catalog and API pages.
+
+DJANGOBOARD_REPLICAS maps database aliases to aliases of their read-only copies. Each request
+picks one copy of every database to read pages from, unless its client posted within the last
+DJANGOBOARD_READ_YOUR_WRITES seconds: the create views set a cookie that pins the client's
+reads to the primaries, so posters always see their own posts. Anything outside of a request
+(management commands, background publishing) reads from the primaries.
+
+Writes always go to the primaries, even for objects that were read from a replica.
+
+`manage.py sync_replicas` copies SQLite primaries to their replicas for local setups.
+"""
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+__all__ = ['replica_of', 'primary_of', 'primary', 'wrote', 'ReadYourWritesMiddleware', 'ReplicaRouter']
+
+COOKIE_NAME = 'djangoboard_wrote'
+
+# which copy of each database the current request reads from, None for the primaries
+_replica = ContextVar('djangoboard_replica', default=None)
+
+
+def replica_of(alias):
+    """The database to read pages of `alias` from."""
+    choice = _replica.get()
+    replicas = settings.DJANGOBOARD_REPLICAS.get(alias)
+    if choice is None or not replicas:
+        return alias
+    return replicas[choice % len(replicas)]
+
+
+def primary_of(alias):
+    for primary_, replicas in settings.DJANGOBOARD_REPLICAS.items():
+        if alias in replicas:
+            return primary_
+    return alias
+
+
+@contextmanager
+def primary():
+    """Reads from the primaries in this block."""
+    token = _replica.set(None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+def wrote(response):
+    """Pins the reads of the client getting `response` to the primaries for a while."""
+    if settings.DJANGOBOARD_REPLICAS:
+        response.set_cookie(COOKIE_NAME, '1', max_age=settings.DJANGOBOARD_READ_YOUR_WRITES,
+                            httponly=True, samesite='Lax')
+    return response
+
+
+class ReadYourWritesMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # not reset afterwards: streamed responses are rendered once this returns, and every
+        # request sets its own choice anyway
+        _replica.set(None if COOKIE_NAME in request.COOKIES else random.randrange(1 << 16))
+        return self.get_response(request)
+
+
+class ReplicaRouter:
+    """Sends writes of objects read from a replica to its primary; replicas are never migrated."""
+
+    def db_for_write(self, model, **hints):
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db and primary_of(instance._state.db) != instance._state.db:
+            return primary_of(instance._state.db)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if obj1._state.db and primary_of(obj1._state.db) == primary_of(obj2._state.db):
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        if primary_of(db) != db:
+            return False
+        return None
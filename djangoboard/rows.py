@@ -0,0 +1,69 @@
+"""
+Light-weight posts for rendering long lists of posts.
+
+Rows are loaded with `.values_list()` and carry only what the post list templates display,
+instead of full model instances; attachments and replies are grouped in dicts by post id.
+"""
+from collections import namedtuple
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.fields.files import FieldFile
+
+from .models import *
+from .models import ImageVariants
+
+__all__ = ['PostRow', 'AttachmentRow', 'post_rows']
+
+class AttachmentRow(ImageVariants, namedtuple('AttachmentRow', ['file', 'mime', 'variants', 'object_id', 'digest'])):
+    __slots__ = ()
+
+
+class PostRow:
+    fields = ('id', 'name', 'subject', 'comment', 'date', 'thread_id')
+    __slots__ = fields + ('attachments', 'replies')
+
+    def __init__(self, id, name, subject, comment, date, thread_id):
+        self.id = id
+        self.name = name
+        self.subject = subject
+        self.comment = comment
+        self.date = date
+        self.thread_id = thread_id
+        self.attachments = ()
+        self.replies = ()  # ids of the posts replying to this one
+
+
+def attachments_of(model, ids, using=None):
+    field = Attachment._meta.get_field('file')
+    attachments = {}
+    for object_id, name, mime, variants, digest in Attachment.objects.using(using) \
+            .filter(content_type=ContentType.objects.get_for_model(model), object_id__in=ids) \
+            .values_list('object_id', 'file', 'mime', 'variants', 'digest'):
+        attachments.setdefault(object_id, []).append(
+            AttachmentRow(FieldFile(None, field, name), mime, variants, object_id, digest))
+    return attachments
+
+
+def post_rows(values, using=None):
+    """
+    Turns `values_list(*PostRow.fields)` rows from the database `using` into PostRows with their
+    attachments and replies.
+
+    Returns the posts and a dict of the thread ids of every reply.
+    """
+    posts = [PostRow(*row) for row in values]
+    ids = [post.id for post in posts]
+    attachments = attachments_of(Post, ids, using)
+
+    replies, reply_threads = {}, {}
+    for post_id, reply_id, thread_id in Post.replies.through.objects.using(using) \
+            .filter(from_post_id__in=ids) \
+            .order_by('to_post__date') \
+            .values_list('from_post_id', 'to_post_id', 'to_post__thread_id'):
+        replies.setdefault(post_id, []).append(reply_id)
+        reply_threads[reply_id] = thread_id
+
+    for post in posts:
+        post.attachments = attachments.get(post.id, ())
+        post.replies = replies.get(post.id, ())
+    return posts, reply_threads
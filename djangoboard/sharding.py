@@ -0,0 +1,113 @@
+"""
+Threads, posts and their attachments sharded by board across several databases.
+
+DJANGOBOARD_SHARDS lists the database aliases holding threads and posts, and
+DJANGOBOARD_BOARD_SHARDS maps board names to one of them (other boards go to the first).
+Boards themselves live on the default database and are copied to every shard, so that
+threads keep their foreign key to their board.
+
+Thread and post ids are strided: a shard only allocates ids that are its position in
+DJANGOBOARD_SHARDS modulo the number of shards, so any `>>number` or thread URL tells
+where the post is without asking every shard. Changing the list of shards once there are
+posts on them therefore moves existing ids to the wrong shard. Each shard counts the ids it
+allocated in its IdSequence rows, which are updated before anything else is read, so that
+concurrent writers queue up on the write lock instead of racing for the same id.
+
+Every shard needs the full schema: `manage.py migrate --database <alias>`.
+"""
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, connections, transaction
+from django.db.models import F, Max
+
+from .models import *
+
+__all__ = ['shards', 'shard_for_board', 'shard_of', 'by_shard', 'next_id', 'ShardRouter']
+
+
+def shards():
+    return settings.DJANGOBOARD_SHARDS
+
+
+def shard_for_board(name):
+    return settings.DJANGOBOARD_BOARD_SHARDS.get(name, shards()[0])
+
+
+def shard_of(id_):
+    """Database of the thread or post with id `id_`."""
+    return shards()[int(id_) % len(shards())]
+
+
+def by_shard(ids):
+    """Groups thread or post ids by their database."""
+    grouped = {}
+    for id_ in ids:
+        grouped.setdefault(shard_of(id_), []).append(id_)
+    return grouped
+
+
+def first_id(model, using):
+    """The first id for `model` on the shard `using`, after the ids already used."""
+    stride, position = len(shards()), shards().index(using)
+    table = model._meta.db_table
+    last = model.objects.using(using).aggregate(last=Max('id'))['last'] or 0
+    if connections[using].vendor == 'sqlite':
+        # AUTOINCREMENT keeps the largest id ever used, ids of deleted posts are never reused
+        with connections[using].cursor() as cursor:
+            cursor.execute('SELECT seq FROM sqlite_sequence WHERE name = %s', [table])
+            row = cursor.fetchone()
+            last = max(last, row[0] if row else 0)
+    return last + 1 + (position - last - 1) % stride
+
+
+def next_id(model, using):
+    """The next id for a new `model` instance on the shard `using`."""
+    table = model._meta.db_table
+    sequences = IdSequence.objects.using(using).filter(table=table)
+    with transaction.atomic(using=using):
+        # the update takes the write lock before anything is read in the transaction
+        if not sequences.update(last=F('last') + len(shards())):
+            try:
+                with transaction.atomic(using=using):
+                    IdSequence.objects.using(using).create(table=table, last=first_id(model, using))
+            except IntegrityError:  # created by a concurrent writer
+                sequences.update(last=F('last') + len(shards()))
+        return sequences.values_list('last', flat=True).get()
+
+
+class ShardRouter:
+    """
+    Sends new threads, posts and attachments to the shard of their board.
+
+    Objects read from a shard are saved back to it, and related objects are looked up on the
+    database of the object they are related to (Django's behaviour without a router), so views
+    only have to pick the shard of the queries they start with `.using()`.
+    """
+    sharded = (Thread, Post, Post.replies.through, Attachment)
+
+    def db_for(self, model, instance):
+        if instance is None or model not in self.sharded:
+            return None
+        if isinstance(instance, Board):
+            return shard_for_board(instance.name)
+        if instance._state.db:
+            return None
+        if isinstance(instance, Thread):
+            return shard_for_board(instance.board_id)
+        if isinstance(instance, Post):
+            return shard_of(instance.thread_id)
+        if isinstance(instance, Attachment):
+            return shard_of(instance.object_id)
+        return None
+
+    def db_for_read(self, model, **hints):
+        return self.db_for(model, hints.get('instance'))
+
+    def db_for_write(self, model, **hints):
+        return self.db_for(model, hints.get('instance'))
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # boards are copied to every shard, content types are the same on all of them
+        if isinstance(obj1, (Board, ContentType)) or isinstance(obj2, (Board, ContentType)):
+            return True
+        return None
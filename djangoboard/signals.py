@@ -0,0 +1,122 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.urls import reverse
+from guardian.models import GroupObjectPermission, UserObjectPermission
+
+from . import permissions, publishing, sharding, stats
+from .models import *
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            for pragma, value in settings.DJANGOBOARD_SQLITE_PRAGMAS.items():
+                cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Thread)
+def republish_thread(sender, instance, using, **kwargs):
+    if settings.DJANGOBOARD_STATIC_EXPORT_ROOT:
+        thread_id = instance.thread_id if sender is Post else instance.id
+        # once the shard of the post has committed it, not the default database
+        transaction.on_commit(lambda: publishing.schedule(publishing.publish_thread, thread_id), using=using)
+
+
+@receiver(m2m_changed, sender=Post.replies.through)
+def republish_replied_threads(sender, instance, action, reverse, pk_set, using, **kwargs):
+    # replies are listed under the posts they reply to, which may be in other threads
+    if settings.DJANGOBOARD_STATIC_EXPORT_ROOT and action == 'post_add' and pk_set:
+        replied = pk_set if reverse else [instance.id]
+        threads = Post.objects.using(using).filter(id__in=replied).values_list('thread_id', flat=True).distinct()
+        for thread_id in threads:
+            transaction.on_commit(lambda thread_id=thread_id: publishing.schedule(publishing.publish_thread,
+                                                                                  thread_id),
+                                  using=using)
+
+
+@receiver(post_delete, sender=Thread)
+def unpublish_thread(sender, instance, using, **kwargs):
+    if settings.DJANGOBOARD_STATIC_EXPORT_ROOT:
+        urls = (reverse('djangoboard:thread', args=[instance.id]),
+                reverse('djangoboard:board', args=[instance.board_id]))
+
+        def unpublish():
+            for url in urls:
+                publishing.schedule(publishing.publish, url)
+
+        transaction.on_commit(unpublish, using=using)
+
+
+def board_of(post):
+    if Post.thread.is_cached(post):
+        return post.thread.board_id
+    return Thread.objects.using(post._state.db).filter(id=post.thread_id).values_list('board', flat=True).first()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Thread)
+def count_post(sender, instance, created, **kwargs):
+    if created:
+        stats.record_post(board_of(instance) if sender is Post else instance.board_id, instance.date,
+                          opening=sender is Thread)
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Thread)
+def uncount_post(sender, instance, using, **kwargs):
+    if sender is Post:
+        stats.forget_post(instance.thread_id, using)
+    else:
+        stats.forget_thread(instance.id, instance.board_id, using)
+
+
+@receiver(post_save, sender=Board)
+@receiver(post_delete, sender=Board)
+def invalidate_boards(sender, **kwargs):
+    stats.invalidate()
+    permissions.invalidate()  # superusers moderate every board
+
+
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Thread)
+def allocate_id(sender, instance, raw, using, **kwargs):
+    if instance.id is None and not raw and len(sharding.shards()) > 1:
+        instance.id = sharding.next_id(sender, using)
+
+
+@receiver(post_save, sender=Board)
+def replicate_board(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        fields = {field.attname: getattr(instance, field.attname) for field in Board._meta.concrete_fields}
+        for shard in set(sharding.shards()) - {DEFAULT_DB_ALIAS}:
+            Board(**fields).save(using=shard)
+
+
+@receiver(post_delete, sender=Board)
+def unreplicate_board(sender, instance, using, **kwargs):
+    if using == DEFAULT_DB_ALIAS:
+        for shard in set(sharding.shards()) - {DEFAULT_DB_ALIAS}:
+            Board.objects.using(shard).filter(name=instance.name).delete()
+
+
+@receiver(post_save, sender=UserObjectPermission)
+@receiver(post_delete, sender=UserObjectPermission)
+@receiver(post_save, sender=GroupObjectPermission)
+@receiver(post_delete, sender=GroupObjectPermission)
+@receiver(m2m_changed, sender=User.groups.through)
+def invalidate_permissions(sender, **kwargs):
+    permissions.invalidate()
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_permissions(sender, update_fields, **kwargs):
+    # is_active and is_superuser matter, the last_login saved on every login doesn't
+    if update_fields is None or set(update_fields) != {'last_login'}:
+        permissions.invalidate()
@@ -0,0 +1,126 @@
+"""
+Near-duplicate detection for copy-paste spam.
+
+Every process remembers the recent posts of each board as 64-bit simhashes of their normalized
+comments, and as digests of their attachments. A post whose comment is within a few bits of a
+recent one, or which attaches a recently attached file, is rejected while its form is validated,
+before anything is written. Posts are only remembered once they are saved, so that a post that
+failed to save can be sent again.
+
+Filtering is configured per board in DJANGOBOARD_DUPLICATE_FILTER, with '*' for every other board:
+
+    'window': seconds a post is remembered after it was last seen,
+    'distance': highest Hamming distance between the simhashes of duplicates (0 for exact copies),
+    'min_length': comments shorter than this, once normalized, are never duplicates,
+    'size': number of posts remembered per board; the least recently seen are forgotten first.
+"""
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+__all__ = ['normalize', 'simhash', 'FingerprintIndex', 'fingerprints', 'is_duplicate', 'remember']
+
+POST_LINK = re.compile(r'>>\d+')
+NON_WORD = re.compile(r'\W+')
+
+
+def normalize(text):
+    """Lowercase words of `text`, without punctuation and the post links spammers vary."""
+    return NON_WORD.sub(' ', POST_LINK.sub(' ', text).casefold()).strip()
+
+
+def simhash(text):
+    """64-bit simhash of the four-character shingles of a normalized `text`."""
+    shingles = {text[i:i + 4] for i in range(max(len(text) - 3, 1))}
+    weights = [0] * 64
+    for shingle in shingles:
+        bits = format(int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=8).digest(), 'big'), '064b')
+        for i, bit in enumerate(bits):
+            weights[i] += 1 if bit == '1' else -1
+    return int(''.join('1' if weight > 0 else '0' for weight in weights), 2)
+
+
+class FingerprintIndex:
+    """Fingerprints seen within the last `window` seconds, at most `size` of them."""
+
+    def __init__(self, size, window):
+        self.size = size
+        self.window = window
+        self.seen = OrderedDict()  # fingerprint -> when it was last seen, least recent first
+        self.lock = threading.Lock()
+
+    def expire(self, now):
+        while self.seen and next(iter(self.seen.values())) <= now - self.window:
+            self.seen.popitem(last=False)
+
+    def find(self, fingerprint, distance=0, now=None):
+        """Whether `fingerprint` is within `distance` bits of a remembered one."""
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.expire(now)
+            if fingerprint in self.seen:
+                match = fingerprint
+            elif distance:
+                match = next((seen for seen in self.seen if bin(seen ^ fingerprint).count('1') <= distance), None)
+            else:
+                match = None
+            if match is not None:
+                # a spam wave keeps its original fresh
+                self.seen[match] = now
+                self.seen.move_to_end(match)
+            return match is not None
+
+    def add(self, fingerprint, now=None):
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            self.expire(now)
+            self.seen[fingerprint] = now
+            self.seen.move_to_end(fingerprint)
+            if len(self.seen) > self.size:
+                self.seen.popitem(last=False)
+
+
+indexes = {}  # (board name, 'comments' or 'attachments') -> FingerprintIndex
+indexes_lock = threading.Lock()
+
+
+def index(board, kind, options):
+    with indexes_lock:
+        if (board, kind) not in indexes:
+            indexes[board, kind] = FingerprintIndex(options['size'], options['window'])
+        return indexes[board, kind]
+
+
+def fingerprints(board, comment, digests=()):
+    """
+    The (index, fingerprint, distance) of a post of `comment` on `board`, with files of `digests`
+    (see djangoboard.media.digest).
+    """
+    filters = settings.DJANGOBOARD_DUPLICATE_FILTER
+    options = filters.get(board, filters.get('*'))
+    if not options:
+        return []
+
+    found = []
+    text = normalize(comment or '')
+    if len(text) >= options['min_length']:
+        found.append((index(board, 'comments', options), simhash(text), options['distance']))
+    for digest in digests:
+        found.append((index(board, 'attachments', options), int(digest, 16), 0))
+    return found
+
+
+def is_duplicate(fingerprints_):
+    """Whether a post with `fingerprints_` repeats a recent one."""
+    # every index is looked at, so that each keeps the original of a spam wave fresh
+    return any([index_.find(fingerprint, distance) for index_, fingerprint, distance in fingerprints_])
+
+
+def remember(fingerprints_):
+    """Remembers a saved post with `fingerprints_`."""
+    for index_, fingerprint, distance in fingerprints_:
+        index_.add(fingerprint)
@@ -0,0 +1,150 @@
+"""
+Board statistics, maintained incrementally on every write so that the homepage never aggregates posts.
+
+Deleted posts and threads are uncounted together once their transaction commits, with one update
+per board however many posts a deletion cascades to.
+
+Recent activity is counted in buckets of DJANGOBOARD_ACTIVITY_BUCKET seconds: the posts of the last
+hour (or day) are the sum of the buckets that started within it. Buckets older than a day are dropped.
+"""
+import threading
+import weakref
+from collections import Counter
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Greatest
+from django.urls import reverse
+from django.utils import timezone
+
+from . import publishing
+from .models import *
+
+__all__ = ['record_post', 'forget_post', 'forget_thread', 'boards', 'invalidate']
+
+CACHE_KEY = 'djangoboard:boards'
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+def bucket(date):
+    """Start of the activity bucket `date` falls into."""
+    timestamp = date.timestamp()
+    return datetime.fromtimestamp(timestamp - timestamp % settings.DJANGOBOARD_ACTIVITY_BUCKET, timezone.utc)
+
+
+def record_activity(board, date):
+    start = bucket(date)
+    if start <= bucket(timezone.now()) - DAY:
+        return
+    if BoardActivity.objects.filter(board=board, start=start).update(posts=F('posts') + 1):
+        return
+    try:
+        with transaction.atomic():
+            BoardActivity.objects.create(board_id=board, start=start, posts=1)
+    except IntegrityError:  # created by a concurrent write
+        BoardActivity.objects.filter(board=board, start=start).update(posts=F('posts') + 1)
+    BoardActivity.objects.filter(board=board, start__lte=start - DAY).delete()
+
+
+def record_post(board, date, opening=False):
+    """Counts a new post on `board`; `opening` posts also count a new thread."""
+    date_ = Value(date, output_field=DateTimeField())
+    Board.objects.filter(name=board).update(
+        thread_count=F('thread_count') + int(opening),
+        post_count=F('post_count') + 1,
+        last_activity=Greatest(Coalesce('last_activity', date_), date_))
+    record_activity(board, date)
+    invalidate()
+
+
+class Deletions:
+    """Posts and threads deleted from the database `using` in one transaction."""
+
+    def __init__(self, using):
+        self.using = using
+        self.threads = {}  # id of a deleted thread -> its board
+        self.posts = Counter()  # thread id -> number of its deleted posts
+        self.flushed = False
+
+    def flush(self):
+        if self.flushed:  # scheduled once per deletion
+            return
+        self.flushed = True
+        boards = dict(self.threads)
+        boards.update(Thread.objects.using(self.using).filter(id__in=set(self.posts) - set(self.threads))
+                      .values_list('id', 'board'))
+        threads = Counter(self.threads.values())
+        posts = Counter(threads)  # opening posts
+        for thread_id, count in self.posts.items():
+            if thread_id in boards:
+                posts[boards[thread_id]] += count
+        for board, count in posts.items():
+            Board.objects.filter(name=board).update(
+                thread_count=Greatest(F('thread_count') - threads[board], Value(0)),
+                post_count=Greatest(F('post_count') - count, Value(0)))
+        invalidate()
+
+
+_local = threading.local()
+
+
+def deletions(using):
+    """
+    The deletions of the current transaction on `using`, uncounted once it commits.
+
+    Only the commit callbacks of the transaction keep them: one that is rolled back drops its
+    callbacks, and its deletions with them.
+    """
+    if not hasattr(_local, 'deletions'):
+        _local.deletions = weakref.WeakValueDictionary()  # database alias -> Deletions
+    pending = _local.deletions.get(using)
+    if pending is None or pending.flushed:
+        pending = _local.deletions[using] = Deletions(using)
+    return pending
+
+
+def forget_post(thread_id, using):
+    """Uncounts a deleted post; recent activity and the last activity date stay as they were."""
+    pending = deletions(using)
+    pending.posts[thread_id] += 1
+    transaction.on_commit(pending.flush, using=using)  # right away outside of transactions
+
+
+def forget_thread(thread_id, board, using):
+    """Uncounts a deleted thread and its opening post."""
+    pending = deletions(using)
+    pending.threads[thread_id] = board
+    transaction.on_commit(pending.flush, using=using)
+
+
+def invalidate():
+    def changed():
+        cache.delete(CACHE_KEY)
+        if settings.DJANGOBOARD_STATIC_EXPORT_ROOT:
+            publishing.schedule(publishing.publish, reverse('djangoboard:homepage'))
+
+    transaction.on_commit(changed)
+
+
+def boards():
+    """The boards with their statistics, from a snapshot cached until the next change (or the next bucket)."""
+    snapshot = cache.get(CACHE_KEY)
+    if snapshot is None:
+        current = bucket(timezone.now())
+        activity = {row['board']: row for row in BoardActivity.objects
+                    .filter(start__gt=current - DAY)
+                    .values('board')
+                    .annotate(posts_last_day=Sum('posts'),
+                              posts_last_hour=Sum('posts', filter=Q(start__gt=current - HOUR)))}
+        snapshot = list(Board.objects.values('name', 'short_description', 'thread_count', 'post_count',
+                                             'last_activity'))
+        for board in snapshot:
+            recent = activity.get(board['name'], {})
+            board['posts_last_hour'] = recent.get('posts_last_hour') or 0
+            board['posts_last_day'] = recent.get('posts_last_day') or 0
+        cache.set(CACHE_KEY, snapshot, settings.DJANGOBOARD_ACTIVITY_BUCKET)
+    return snapshot
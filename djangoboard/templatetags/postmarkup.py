@@ -1,51 +1,116 @@
 import re
+from urllib.parse import quote
 
 from django import template
 from django.urls import reverse
 from django.utils.html import escape, linebreaks, mark_safe
+from django.utils.http import RFC3986_SUBDELIMS
+
+from djangoboard.models import Post
+from djangoboard.replicas import replica_of
+from djangoboard.sharding import by_shard
 
 register = template.Library()
 
 
+MAX_ID = 2 ** 63 - 1  # larger numbers can't be ids, they are left as plain text
+
+
 def find_all_replies(text):
-    return re.findall(re.compile(r'(?<!>)>>(\d+)'), text)
+    return [number for number in re.findall(re.compile(r'(?<!>)>>(\d+)'), text) if int(number) <= MAX_ID]
+
+
+class Urls:
+    """The URLs that markup links point to, with `reverse()` run once rather than for every link."""
+    placeholder = '00000'
+
+    def __init__(self):
+        self._post = reverse('djangoboard:post', args=[self.placeholder])
+        self._thread = reverse('djangoboard:thread', args=[self.placeholder])
+        self._board = reverse('djangoboard:board', args=[self.placeholder])
+
+    def post(self, number):
+        return self._post.replace(self.placeholder, str(number))
+
+    def thread(self, number):
+        return self._thread.replace(self.placeholder, str(number))
+
+    def board(self, name):
+        # quoted like reverse() quotes its arguments
+        return self._board.replace(self.placeholder, quote(name, safe=RFC3986_SUBDELIMS + '/~:@'))
+
+
+class PostLinks:
+    """
+    Where the `>>number` links of a page point to.
+
+    Posts of the displayed thread (if any) are linked as anchors, posts of other threads
+    directly by their thread's URL, and unknown posts through the `post` redirect view.
+    """
+
+    def __init__(self, threads, thread_id=None, urls=None):
+        self.threads = threads  # post id -> thread id
+        self.thread_id = thread_id
+        self.urls = urls or Urls()
+
+    def __contains__(self, number):
+        return self.thread_id is not None and self.threads.get(number) == self.thread_id
+
+    @classmethod
+    def resolve(cls, comments, thread_id=None, known=None, urls=None):
+        """Looks up the threads of every post quoted in `comments` in one query; `known` maps post ids to threads."""
+        threads = dict(known or {})
+        quoted = {int(number) for comment in comments if comment for number in find_all_replies(comment)}
+        quoted.difference_update(threads)
+        for shard, ids in by_shard(quoted).items():
+            threads.update(Post.objects.using(replica_of(shard)).filter(id__in=ids).values_list('id', 'thread_id'))
+        return cls(threads, thread_id, urls)
 
 
 @register.filter('get_post_link')
-def get_post_link(number, displayed_post_ids):
-    if int(number) not in displayed_post_ids:
-        link = reverse('djangoboard:post', args=[number])
-    else:
+def get_post_link(number, displayed_post_ids, urls=None):
+    urls = urls or getattr(displayed_post_ids, 'urls', None) or Urls()
+    number = int(number)
+    if number > MAX_ID:
+        return mark_safe('&gt;&gt;%s' % number)
+    thread_id = getattr(displayed_post_ids, 'threads', {}).get(number)
+    if number in displayed_post_ids:
         link = '#%s' % number
+    elif thread_id is not None:
+        link = '%s#%s' % (urls.thread(thread_id), number)
+    else:
+        link = urls.post(number)
     return mark_safe('<a href="%s">&gt;&gt;%s</a>' % (link, number))
 
 
-def get_thread_link(number):
-    link = reverse('djangoboard:thread', args=[number])
-    return '<a href="%s">&gt;&gt;&gt;%s</a>' % (link, number)
+def get_thread_link(number, urls):
+    if int(number) > MAX_ID:
+        return '&gt;&gt;&gt;%s' % number
+    return '<a href="%s">&gt;&gt;&gt;%s</a>' % (urls.thread(number), number)
 
 
-def get_board_link(name):
-    link = reverse('djangoboard:board', args=[name])
-    return '<a href="%s">&gt;&gt;&gt;&gt;%s</a>' % (link, name)
+def get_board_link(name, urls):
+    return '<a href="%s">&gt;&gt;&gt;&gt;%s</a>' % (urls.board(name), name)
+
+
+BOARD_LINK = re.compile(r'&gt;&gt;&gt;&gt;([^\s<]*)')  # ">>>>name" links (boards)
+THREAD_LINK = re.compile(r'&gt;&gt;&gt;(\d+)')  # ">>>number" links (threads)
+POST_LINK = re.compile(r'(?<!&gt;)(&gt;&gt;)(\d+)')  # ">>number" links (posts)
+QUOTE = re.compile(r'(?<!&gt;)(&gt;[^&\d<].+?)(?=<)')
+ORANGE_QUOTE = re.compile(r'(?<!&gt;)(&lt;[^&].+?)(?=<)')
 
 
 @register.filter('postmarkup')
 def postmarkup(text, displayed_post_ids=[]):
     if text:
+        urls = getattr(displayed_post_ids, 'urls', None) or Urls()
         text = linebreaks(escape(text))
         replacements = (
-            (re.compile(r'&gt;&gt;&gt;&gt;([^\s<]*)'),
-             lambda match: get_board_link(match.group(1))),  # ">>>number" links (boards)
-
-            (re.compile(r'&gt;&gt;&gt;(\d+)'),
-             lambda match: get_thread_link(match.group(1))),  # ">>>number" links (threads)
-
-            (re.compile(r'(?<!&gt;)(&gt;&gt;)(\d+)'),
-             lambda match: get_post_link(match.group(2), displayed_post_ids)),  # ">>number" links (posts)
-
-            (re.compile(r'(?<!&gt;)(&gt;[^&\d<].+?)(?=<)'), r'<span class="quote">\1</span>'),  # quotes
-            (re.compile(r'(?<!&gt;)(&lt;[^&].+?)(?=<)'), r'<span class="orange">\1</span>'),  # orange quotes
+            (BOARD_LINK, lambda match: get_board_link(match.group(1), urls)),
+            (THREAD_LINK, lambda match: get_thread_link(match.group(1), urls)),
+            (POST_LINK, lambda match: get_post_link(match.group(2), displayed_post_ids, urls)),
+            (QUOTE, r'<span class="quote">\1</span>'),
+            (ORANGE_QUOTE, r'<span class="orange">\1</span>'),
         )
         for old, new in replacements:
             text = re.sub(old, new, text)
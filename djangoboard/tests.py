@@ -1,12 +1,49 @@
+import io
+import os
+import re
+import shutil
+import tempfile
+import threading
+
 from django.conf import settings
-from django.test import TestCase
-from django.test.utils import override_settings
+from django.contrib.auth.models import Group, User
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.template.loader import get_template
+from django.test import Client, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.urls import reverse
 from django.utils import timezone
+from django.utils.datastructures import MultiValueDict
+from PIL import Image
+from easy_thumbnails.files import get_thumbnailer
+from easy_thumbnails.models import Source
+from guardian.shortcuts import assign_perm, remove_perm
 
 from .forms import *
+from . import images, media, permissions, sharding, spam, stats
 from .models import *
-from .templatetags.postmarkup import postmarkup, find_all_replies
+from .models import media_url
+from .rendering import PostListRenderer
+from .rows import PostRow, post_rows
+from .workers import Worker
+from .templatetags.postmarkup import postmarkup, find_all_replies, PostLinks
+
+
+class TempMediaRootMixin:
+    """Stores the uploads of every test in a temporary MEDIA_ROOT, removed afterwards."""
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        media_root = override_settings(MEDIA_ROOT=self.media_root)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
 
 
 class PostThreadModelTest(TestCase):
@@ -59,6 +96,73 @@ class PostFormTest(TestCase):
         self.assertFalse(form.is_valid())
 
 
+@override_settings(DJANGOBOARD_DUPLICATE_FILTER={
+    '*': {'window': 60, 'distance': 8, 'min_length': 20, 'size': 100},
+    'quiet': None,
+})
+class DuplicateFilterTest(TestCase):
+    spam = 'Buy cheap watches at example dot com, the best watches on the whole internet, order today!'
+
+    def setUp(self):
+        spam.indexes.clear()
+        self.board = Board.objects.create(name='mock')
+        self.thread = Thread.objects.create(board=self.board)
+
+    def post(self, comment, thread=None, files=None):
+        """Whether the post is accepted; accepted posts are saved."""
+        form = PostForm(data={'comment': comment, 'thread': (thread or self.thread).id}, files=files)
+        if not form.is_valid():
+            return False
+        with self.captureOnCommitCallbacks(execute=True):
+            form.save()
+        return True
+
+    def test_near_duplicate(self):
+        self.assertTrue(self.post(self.spam))
+        self.assertFalse(self.post('>>12 ' + self.spam.upper()))
+        self.assertFalse(self.post(self.spam.replace('today', 'now')))
+        self.assertTrue(self.post('A genuinely different post about watches and the internet'))
+
+    def test_short_comments(self):
+        self.assertTrue(self.post('bump'))
+        self.assertTrue(self.post('bump'))
+
+    def test_per_board(self):
+        other = Thread.objects.create(board=Board.objects.create(name='other'))
+        quiet = Thread.objects.create(board=Board.objects.create(name='quiet'))
+        self.assertTrue(self.post(self.spam))
+        self.assertTrue(self.post(self.spam, other))
+        self.assertTrue(self.post(self.spam, quiet))
+        self.assertTrue(self.post(self.spam, quiet))
+
+    def test_attachments(self):
+        def files():
+            return MultiValueDict({'attachments_': [SimpleUploadedFile('a.txt', b'same file',
+                                                                       content_type='text/plain')]})
+
+        self.assertTrue(self.post('first', files=files()))
+        self.assertFalse(self.post('second', files=files()))
+
+    def test_not_saved(self):
+        form = PostForm(data={'comment': self.spam, 'thread': self.thread.id})
+        self.assertTrue(form.is_valid())
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            form.save()
+            1 / 0  # the post is rolled back, so is not remembered
+        self.assertTrue(self.post(self.spam))
+
+    def test_window(self):
+        index = spam.FingerprintIndex(size=2, window=60)
+        index.add(1, now=0)
+        self.assertTrue(index.find(1, now=30))
+        self.assertFalse(index.find(1, now=100))
+        index.add(1, now=100)
+        index.add(2, now=100)
+        index.add(4, now=100)
+        self.assertFalse(index.find(1, now=100))  # evicted as the least recently seen
+        self.assertTrue(index.find(5, distance=1, now=100))
+
+
 class ThreadFormTest(TestCase):
     def setUp(self):
         self.board = Board.objects.create(name='mock')
@@ -138,6 +242,7 @@ class BoardViewTest(TestCase):
         self.assertEqual(form.initial['board'], b.name)
 
     def test_num_queries(self):
+        ContentType.objects.get_for_models(Thread, Post)  # cached per process, whichever tests ran earlier
         b = Board.objects.create(name='b')
 
         thread1 = Thread.objects.create(board=b, comment='test thread')
@@ -148,7 +253,7 @@ class BoardViewTest(TestCase):
 
         Post.objects.bulk_create(thread1_replies + thread2_replies)
 
-        with self.assertNumQueries(6):
+        with self.assertNumQueries(6):  # including the conditional GET validator
             self.client.get(reverse('djangoboard:board', args=[b.name]))
 
 
@@ -167,12 +272,33 @@ class ThreadViewTest(TestCase):
         thread = Thread.objects.create(board=self.board, )
         response = self.client.get(reverse('djangoboard:thread', args=[thread.id]))
         self.assertEqual(response.context['thread'], thread)
-        earlier = Post.objects.create(thread=thread, comment='regular post', date=timezone.now())
-        later = Post.objects.create(thread=thread, comment='regular post',
-                                    date=timezone.now() + timezone.timedelta(days=40))
+        Post.objects.create(thread=thread, comment='later post', date=timezone.now() + timezone.timedelta(days=40))
+        Post.objects.create(thread=thread, comment='earlier post', date=timezone.now())
+        content = self.client.get(reverse('djangoboard:thread', args=[thread.id])).getvalue().decode()
+        self.assertLess(content.index('earlier post'), content.index('later post'))
+
+    def test_replies(self):
+        thread = Thread.objects.create(board=self.board, )
+        post = Post.objects.create(thread=thread, comment='regular post')
+        reply = Post.objects.create(thread=thread, comment='>>%i' % post.id)
+        reply.replies_to.add(post)
         response = self.client.get(reverse('djangoboard:thread', args=[thread.id]))
-        self.assertEqual(response.context['posts'][0], earlier)
-        self.assertEqual(response.context['posts'][1], later)
+        content = response.getvalue().decode()
+        self.assertIn('<a href="#%i">&gt;&gt;%i</a>' % (reply.id, reply.id), content)
+        self.assertIn('<a href="#%i">&gt;&gt;%i</a>' % (post.id, post.id), content)
+
+    def test_streaming(self):
+        thread = Thread.objects.create(board=self.board, comment='test thread')
+        Post.objects.bulk_create([Post(thread=thread, comment='post %i' % i) for i in range(25)])
+        with override_settings(DJANGOBOARD_THREAD_CHUNK_SIZE=10):
+            response = self.client.get(reverse('djangoboard:thread', args=[thread.id]))
+            self.assertTrue(response.streaming)
+            chunks = list(response.streaming_content)
+        self.assertEqual(len(chunks), 1 + 3 + 1)  # header, three chunks of posts, footer
+        self.assertIn(b'test thread', chunks[0])
+        self.assertIn(b'post 0', chunks[1])
+        self.assertIn(b'post 24', chunks[3])
+        self.assertIn(b'</html>', chunks[4])
 
     def test_form(self):
         thread = Thread.objects.create(board=self.board, )
@@ -182,6 +308,339 @@ class ThreadViewTest(TestCase):
         self.assertEqual(form.initial['thread'], thread.id)
 
 
+class ConditionalViewTest(TestCase):
+    def setUp(self):
+        self.board = Board.objects.create(name='b')
+        self.thread = Thread.objects.create(board=self.board, comment='test thread')
+
+    def test_thread_not_modified(self):
+        url = reverse('djangoboard:thread', args=[self.thread.id])
+        self.client.get(url)  # sets the CSRF cookie, which is part of the validator
+        response = self.client.get(url)
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        Post.objects.create(thread=self.thread, comment='bump')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_replies_from_other_threads(self):
+        post = Post.objects.create(thread=self.thread, comment='regular post')
+        url = reverse('djangoboard:thread', args=[self.thread.id])
+        self.client.get(url)
+        etag = self.client.get(url)['ETag']
+
+        other = Thread.objects.create(board=self.board, comment='other thread')
+        PostForm(data={'thread': other.id, 'comment': '>>%i' % post.id}).save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Replies:')
+
+        Post.objects.filter(thread=other).delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_board_not_modified(self):
+        url = reverse('djangoboard:board', args=[self.board.name])
+        self.client.get(url)
+        response = self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('djangoboard_post', queries[0]['sql'])  # from the board's counters
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+
+        bump = Post.objects.create(thread=self.thread, comment='bump',
+                                   date=timezone.now() + timezone.timedelta(hours=1))
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            bump.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_moderation_varies(self):
+        url = reverse('djangoboard:thread', args=[self.thread.id])
+        etag = self.client.get(url)['ETag']
+
+        moderator = User.objects.create_user('moderator')
+        assign_perm('delete_posts', moderator, self.board)
+        self.client.force_login(moderator)
+        response = self.client.get(url)
+        self.assertTrue(response.context['moderation'])
+        self.assertNotEqual(response['ETag'], etag)
+
+
+class ModerationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.board = Board.objects.create(name='b')
+        self.thread = Thread.objects.create(board=self.board, comment='test thread')
+        self.post = Post.objects.create(thread=self.thread, comment='regular post')
+        self.moderator = User.objects.create_user('moderator')
+        assign_perm('delete_posts', self.moderator, self.board)
+        self.client.force_login(self.moderator)
+
+    def test_cached(self):
+        self.client.get(reverse('djangoboard:profile'))
+        with self.assertNumQueries(2):  # the session and the user
+            response = self.client.get(reverse('djangoboard:profile'))
+        self.assertContains(response, 'href="/b"')
+
+    def test_delete(self):
+        response = self.client.post(reverse('djangoboard:delete'), {'board': 'b', str(self.post.id): 'on'})
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Post.objects.filter(id=self.post.id).exists())
+
+    def test_revoked(self):
+        self.client.get(reverse('djangoboard:profile'))
+        remove_perm('delete_posts', self.moderator, self.board)
+        response = self.client.post(reverse('djangoboard:delete'), {'board': 'b', str(self.post.id): 'on'})
+        self.assertEqual(response.status_code, 403)
+        self.assertTrue(Post.objects.filter(id=self.post.id).exists())
+
+    def test_group(self):
+        group = Group.objects.create(name='moderators')
+        assign_perm('delete_posts', group, Board.objects.create(name='c'))
+        self.assertNotContains(self.client.get(reverse('djangoboard:profile')), 'href="/c"')
+        self.moderator.groups.add(group)
+        self.assertContains(self.client.get(reverse('djangoboard:profile')), 'href="/c"')
+
+    def test_process_local_cache_check(self):
+        warning, = permissions.check_shared_cache(None)
+        self.assertEqual(warning.id, 'djangoboard.W001')
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.assertEqual(permissions.check_shared_cache(None), [])
+
+
+class PostRowsTest(TestCase):
+    def test_rows(self):
+        thread = Thread.objects.create(board=Board.objects.create(name='b'))
+        post = Post.objects.create(thread=thread, comment='regular post')
+        reply = Post.objects.create(thread=thread, comment='>>%i' % post.id)
+        reply.replies_to.add(post)
+        Attachment.objects.create(post=post, file='uploads/file.txt', mime='text/plain')
+
+        with self.assertNumQueries(3):
+            rows, reply_threads = post_rows(Post.objects.filter(thread=thread).values_list(*PostRow.fields))
+        self.assertEqual([row.id for row in rows], [post.id, reply.id])
+        self.assertEqual(rows[0].comment, 'regular post')
+        self.assertEqual(rows[0].attachments[0].file.url, '/media/uploads/file.txt')
+        self.assertEqual(list(rows[0].replies), [reply.id])
+        self.assertEqual(reply_threads, {reply.id: thread.id})
+
+        response = self.client.get(reverse('djangoboard:thread', args=[thread.id]))
+        self.assertIn('href="/media/uploads/file.txt"', response.getvalue().decode())
+
+
+class PostListRendererTest(TempMediaRootMixin, TestCase):
+    def image(self):
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'orange').save(image, 'PNG')
+        return SimpleUploadedFile('picture.png', image.getvalue(), 'image/png')
+
+    @staticmethod
+    def normalized(html):
+        return re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', str(html))).strip()
+
+    def test_same_html(self):
+        board = Board.objects.create(name='b')
+        thread = Thread.objects.create(board=board, comment='test thread')
+        other_thread = Thread.objects.create(board=board)
+        other = Post.objects.create(thread=other_thread, comment='elsewhere')
+        first = Post.objects.create(thread=thread, name='<b>name</b>', subject='subject & co',
+                                    comment='>greentext\n<orange\n>>%i >>>%i >>>>b >>%i >>99999' % (
+                                        other.id, other_thread.id, other.id))
+        second = Post.objects.create(thread=thread, comment='>>%i' % first.id)
+        second.replies_to.add(first)
+        Post.objects.create(thread=thread, comment=None)
+        Attachment.objects.create(post=first, file=self.image(), mime='image/png')
+        images.process(Attachment.objects.create(post=first, file=self.image(), mime='image/png'))
+        Attachment.objects.create(post=second, file='uploads/file.txt', mime='text/plain')
+
+        posts, reply_threads = post_rows(Post.objects.filter(thread=thread).values_list(*PostRow.fields))
+        reply_threads.update((post.id, post.thread_id) for post in posts)
+        post_links = PostLinks.resolve([post.comment for post in posts], thread.id, reply_threads)
+        template = get_template('djangoboard/post_list_snippet.html')
+        for moderation in (False, True):
+            expected = template.render({'posts': posts, 'post_links': post_links, 'moderation': moderation})
+            rendered = PostListRenderer().render(posts, post_links, moderation)
+            self.assertIn('.png.100x100', rendered)
+            self.assertIn('.png.t100.webp 1x', rendered)
+            self.assertEqual(self.normalized(rendered), self.normalized(expected))
+
+
+class ImageProcessingTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.thread = Thread.objects.create(board=Board.objects.create(name='b'), comment='test thread')
+
+    def post(self, name, image, content_type, process=True, **options):
+        data = io.BytesIO()
+        image.save(data, **options)
+        with self.captureOnCommitCallbacks(execute=process) as self.callbacks:
+            PostForm(data={'thread': self.thread.id, 'comment': name},
+                     files=MultiValueDict({'attachments_': [SimpleUploadedFile(name, data.getvalue(), content_type)]})
+                     ).save()
+        return Attachment.objects.get(file__endswith=name)
+
+    def test_cached_once_processed(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        attachment = self.post('photo.jpg', Image.new('RGB', (50, 40)), 'image/jpeg', process=False,
+                               format='JPEG', exif=exif)
+        url = attachment.url
+        self.assertEqual(self.client.get(url)['Cache-Control'], 'no-cache')
+
+        for callback in self.callbacks:
+            callback()
+        attachment.refresh_from_db()
+        self.assertEqual(attachment.url, url)
+        self.assertEqual(self.client.get(url)['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    def test_photo(self):
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        exif[0x0112] = 6  # rotated 90 degrees
+        attachment = self.post('photo.jpg', Image.new('RGB', (300, 250), 'orange'), 'image/jpeg',
+                               format='JPEG', exif=exif)
+        self.assertEqual((attachment.width, attachment.height), (250, 300))
+        self.assertEqual(attachment.variants.split()[:2], ['t100.webp', 't200.webp'])
+        with Image.open(attachment.file.path) as original:
+            self.assertEqual(original.size, (250, 300))
+            self.assertFalse(original.getexif())
+        with Image.open(attachment.file.path + '.t200.webp') as thumbnail:
+            self.assertEqual(thumbnail.size, (200, 200))
+
+        response = self.client.get(reverse('djangoboard:thread', args=[self.thread.id]))
+        self.assertIn('<source type="image/webp" srcset="%s 1x, %s 2x">' % (
+            attachment.variant_url('t100.webp'), attachment.variant_url('t200.webp')), response.getvalue().decode())
+        self.assertContains(self.client.get(reverse('djangoboard:board', args=['b'])), 'loading="lazy"')
+
+    def test_validators(self):
+        urls = (reverse('djangoboard:api_thread', args=[self.thread.id]), reverse('djangoboard:api_board', args=['b', 1]))
+        attachment = self.post('photo.png', Image.new('RGB', (50, 40)), 'image/png', process=False, format='PNG')
+        etags = [self.client.get(url)['ETag'] for url in urls]
+
+        for callback in self.callbacks:
+            callback()
+        for url, etag in zip(urls, etags):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200, url)
+            self.assertIn('"width":50', response.content.decode())
+
+    def test_without_metadata(self):
+        for name, options in (('photo.jpg', {'format': 'JPEG', 'quality': 70}), ('drawing.png', {'format': 'PNG'})):
+            image = Image.effect_noise((300, 250), 40)
+            data = io.BytesIO()
+            image.save(data, **options)
+            attachment = self.post(name, image, 'image/' + options['format'].lower(), **options)
+            self.assertEqual((attachment.width, attachment.height), (300, 250))
+            with open(attachment.file.path, 'rb') as f:
+                self.assertEqual(f.read(), data.getvalue())
+
+    def test_replaced_in_place(self):
+        attachment = self.post('photo.jpg', Image.new('RGB', (50, 40)), 'image/jpeg', process=False, format='JPEG')
+        inode = os.stat(attachment.file.path).st_ino
+        images.replace(attachment.file.storage, attachment.file.name, b'stripped')
+        with open(attachment.file.path, 'rb') as f:
+            self.assertEqual(f.read(), b'stripped')
+        self.assertNotEqual(os.stat(attachment.file.path).st_ino, inode)  # renamed over the original
+        self.assertEqual(os.listdir(os.path.dirname(attachment.file.path)), ['photo.jpg'])
+
+    def test_small_image(self):
+        attachment = self.post('small.png', Image.new('RGB', (50, 40), 'orange'), 'image/png', format='PNG')
+        self.assertEqual(attachment.variants.split()[0], 't100.webp')
+        self.assertNotIn('t200.webp', attachment.variants)
+        with Image.open(attachment.file.path + '.t100.webp') as thumbnail:
+            self.assertEqual(thumbnail.size, (50, 40))
+
+    def test_not_an_image(self):
+        with self.assertLogs('djangoboard.images', 'ERROR'), self.captureOnCommitCallbacks(execute=True):
+            PostForm(data={'thread': self.thread.id, 'comment': 'fake'},
+                     files=MultiValueDict({'attachments_': [SimpleUploadedFile('fake.png', b'not an image', 'image/png')]})
+                     ).save()
+        attachment = Attachment.objects.get(file__endswith='fake.png')
+        self.assertIsNone(attachment.width)
+        self.assertEqual(attachment.variants, '')
+
+
+class MediaTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.thread = Thread.objects.create(board=Board.objects.create(name='b'), comment='test thread')
+        PostForm(data={'thread': self.thread.id, 'comment': 'file'},
+                 files=MultiValueDict({'attachments_': [SimpleUploadedFile('file.txt', b'content', 'text/plain')]})
+                 ).save()
+        self.attachment = Attachment.objects.get()
+
+    def test_versioned_url(self):
+        self.assertEqual(self.attachment.digest, media.digest([b'content']))
+        self.assertEqual(self.attachment.url, '/files/%i/%s/%s' % (
+            self.attachment.object_id, self.attachment.digest, self.attachment.file.name))
+        for name in ('uploads/a b.txt', 'uploads/ü?#%.txt'):
+            self.assertEqual(media_url(1, 'digest', name), reverse('djangoboard:media', args=[1, 'digest', name]))
+        self.assertContains(self.client.get(reverse('djangoboard:thread', args=[self.thread.id])),
+                            'href="%s"' % self.attachment.url)
+
+    def test_serve(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.attachment.url)
+        self.assertEqual(b''.join(response.streaming_content), b'content')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+
+    @override_settings(DJANGOBOARD_SENDFILE='X-Accel-Redirect')
+    def test_x_accel_redirect(self):
+        response = self.client.get(self.attachment.url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + self.attachment.file.name)
+        self.assertEqual(response['Content-Type'], 'text/plain')
+        self.assertEqual(response.content, b'')
+
+    @override_settings(DJANGOBOARD_SENDFILE='X-Sendfile')
+    def test_x_sendfile(self):
+        response = self.client.get(self.attachment.url)
+        self.assertEqual(response['X-Sendfile'], self.attachment.file.path)
+        self.assertIn('immutable', response['Cache-Control'])
+
+    def test_derivatives(self):
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'orange').save(image, 'PNG')
+        attachment = Attachment.objects.create(post=self.thread, mime='image/png', digest='digest', variants='webp',
+                                               file=SimpleUploadedFile('image.png', image.getvalue()))
+        attachment.file.storage.save(attachment.file.name + '.webp', ContentFile(b'variant'))
+        response = self.client.get(attachment.variant_url('webp'))
+        self.assertEqual(b''.join(response.streaming_content), b'variant')
+        url = attachment.thumbnail_url
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_other_uploads_extending_the_name(self):
+        PostForm(data={'thread': self.thread.id, 'comment': 'page'},
+                 files=MultiValueDict({'attachments_': [SimpleUploadedFile(self.attachment.file.name[len('uploads/'):]
+                                                                           + '.html', b'<script>', 'text/html')]})
+                 ).save()
+        name = self.attachment.file.name + '.html'
+        Attachment.objects.get(file=name).post.delete()
+        self.assertTrue(os.path.exists(os.path.join(self.media_root, name)))
+        response = self.client.get(media_url(self.attachment.object_id, self.attachment.digest, name))
+        self.assertEqual(response.status_code, 404)
+
+    def test_not_found(self):
+        object_id, digest, name = self.attachment.object_id, self.attachment.digest, self.attachment.file.name
+        for url in (media_url(object_id, 'f' * 16, name),
+                    media_url(object_id + 1, digest, name),
+                    media_url(object_id, digest, 'uploads/other.txt'),
+                    media_url(object_id, digest, name + './../other.txt')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404, url)
+            self.assertNotIn('immutable', response.get('Cache-Control', ''))
+
+        url = self.attachment.url
+        Post.objects.all().delete()
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
 class PostMarkupTest(TestCase):
     def test_links(self):
         text = 'Blah >>blah >>1 >1'
@@ -213,6 +672,30 @@ class PostMarkupTest(TestCase):
         self.assertEqual(marked_up.count('<a'), 2)
         self.assertEqual(marked_up.count('thread'), 2)
 
+    def test_numbers_too_large(self):
+        text = '>>99999999999999999999999 >>>99999999999999999999999'
+        self.assertEqual(find_all_replies(text), [])
+        self.assertNotIn('<a', postmarkup(text))
+        thread = Thread.objects.create(board=Board.objects.create(name='b'), comment=text)
+        self.assertEqual(self.client.get(reverse('djangoboard:thread', args=[thread.id])).status_code, 200)
+        self.assertEqual(self.client.get(reverse('djangoboard:board', args=['b'])).status_code, 200)
+
+    def test_links_resolved(self):
+        board = Board.objects.create(name='mock')
+        thread = Thread.objects.create(board=board)
+        other_thread = Thread.objects.create(board=board)
+        post = Post.objects.create(thread=thread)
+        other_post = Post.objects.create(thread=other_thread)
+
+        text = '>>%i >>%i >>12345' % (post.id, other_post.id)
+        with self.assertNumQueries(1):
+            links = PostLinks.resolve([text], thread.id)
+        marked_up = postmarkup(text, links)
+        self.assertIn('href="#%i"' % post.id, marked_up)
+        self.assertIn('href="%s#%i"' % (reverse('djangoboard:thread', args=[other_thread.id]), other_post.id),
+                      marked_up)
+        self.assertIn('href="%s"' % reverse('djangoboard:post', args=[12345]), marked_up)
+
     def test_find_all_links(self):
         text = '>>1 >>2 >>asdf >1'
         links = find_all_replies(text)
@@ -361,3 +844,403 @@ class PostViewTest(TestCase):
                                    comment='I can now post')
         response = self.client.get(reverse('djangoboard:post', args=[post.id]))
         self.assertEqual(response.status_code, 302)
+
+
+class ApiTest(TestCase):
+    def setUp(self):
+        self.board = Board.objects.create(name='b', short_description='random')
+        self.thread = Thread.objects.create(board=self.board, comment='test thread')
+
+    def test_boards(self):
+        response = self.client.get(reverse('djangoboard:api_boards'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{'name': 'b', 'short_description': 'random', 'description': ''}])
+
+    def test_thread(self):
+        post = Post.objects.create(thread=self.thread, comment='regular post')
+        reply = Post.objects.create(thread=self.thread, comment='>>%i' % post.id)
+        reply.replies_to.add(post)
+        response = self.client.get(reverse('djangoboard:api_thread', args=[self.thread.id]))
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['comment'], 'test thread')
+        self.assertEqual([p['id'] for p in data['posts']], [post.id, reply.id])
+        self.assertEqual(data['posts'][0]['replies'], [reply.id])
+        self.assertEqual(self.client.get(reverse('djangoboard:api_thread', args=[123])).status_code, 404)
+
+    def test_board_pages(self):
+        for i in range(settings.DJANGOBOARD_POSTS_PREVIEWED + 5):
+            Post.objects.create(thread=self.thread, comment='post %i' % i)
+        response = self.client.get(reverse('djangoboard:api_board', args=['b', 1]))
+        self.assertEqual(response.status_code, 200)
+        threads = response.json()['threads']
+        self.assertEqual(threads[0]['id'], self.thread.id)
+        self.assertEqual(threads[0]['num_replies'], settings.DJANGOBOARD_POSTS_PREVIEWED + 5)
+        self.assertEqual(len(threads[0]['posts']), settings.DJANGOBOARD_POSTS_PREVIEWED)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_board', args=['b', 2])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_board', args=['b', 0])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_board', args=['c', 1])).status_code, 404)
+
+    def test_catalog(self):
+        response = self.client.get(reverse('djangoboard:api_catalog', args=['b']))
+        self.assertEqual([t['id'] for t in response.json()['threads']], [self.thread.id])
+
+    def test_not_modified(self):
+        url = reverse('djangoboard:api_thread', args=[self.thread.id])
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        Post.objects.create(thread=self.thread, comment='bump')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_replies_from_other_threads(self):
+        post = Post.objects.create(thread=self.thread, comment='regular post')
+        url = reverse('djangoboard:api_thread', args=[self.thread.id])
+        etag = self.client.get(url)['ETag']
+
+        other = Thread.objects.create(board=self.board, comment='other thread')
+        PostForm(data={'thread': other.id, 'comment': '>>%i' % post.id}).save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['posts'][0]['replies'], [other.posts.get().id])
+
+    def test_board_not_modified(self):
+        url = reverse('djangoboard:api_catalog', args=['b'])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        Thread.objects.create(board=self.board, comment='another thread')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class BoardStatsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.board = Board.objects.create(name='b', short_description='random')
+        self.thread = Thread.objects.create(board=self.board, comment='test thread')
+
+    def test_counts(self):
+        post = Post.objects.create(thread=self.thread, comment='regular post')
+        self.board.refresh_from_db()
+        self.assertEqual((self.board.thread_count, self.board.post_count), (1, 2))
+        self.assertEqual(self.board.last_activity, post.date)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thread.delete()
+        self.board.refresh_from_db()
+        self.assertEqual((self.board.thread_count, self.board.post_count), (0, 0))
+
+    def test_bulk_delete(self):
+        other = Thread.objects.create(board=self.board, comment='other thread')
+        Post.objects.bulk_create([Post(thread=thread, comment='post') for thread in (self.thread, other)] * 5)
+        stats.record_post('b', timezone.now())  # bulk_create sends no signals
+        Board.objects.filter(name='b').update(post_count=12)
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(thread=other).delete()
+            self.thread.delete()
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "djangoboard_board"')]), 1)
+        self.board.refresh_from_db()
+        self.assertEqual((self.board.thread_count, self.board.post_count), (1, 1))
+
+    def test_rolled_back_delete(self):
+        post = Post.objects.create(thread=self.thread, comment='regular post')
+        with self.assertRaises(ZeroDivisionError), transaction.atomic():
+            post.delete()
+            1 / 0
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(thread=self.thread, comment='another post').delete()
+        self.board.refresh_from_db()
+        self.assertEqual(self.board.post_count, 2)
+
+    def test_recent_activity(self):
+        Post.objects.create(thread=self.thread, comment='regular post')
+        Post.objects.create(thread=self.thread, comment='old post', date=timezone.now() - timezone.timedelta(hours=2))
+        Post.objects.create(thread=self.thread, comment='older post', date=timezone.now() - timezone.timedelta(days=2))
+        board, = stats.boards()
+        self.assertEqual(board['post_count'], 4)
+        self.assertEqual(board['posts_last_hour'], 2)
+        self.assertEqual(board['posts_last_day'], 3)
+
+    def test_home_page_cached(self):
+        self.client.get(reverse('djangoboard:homepage'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('djangoboard:homepage'))
+        self.assertRegex(response.content.decode(), r'1 thread,\s+1 post,')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(thread=self.thread, comment='regular post')
+        self.assertRegex(self.client.get(reverse('djangoboard:homepage')).content.decode(), r'1 thread,\s+2 posts,')
+
+
+@override_settings(DJANGOBOARD_REQUIRE_CAPTCHA=False,
+                   DJANGOBOARD_SHARDS=['default', 'shard1', 'shard2'],
+                   DJANGOBOARD_BOARD_SHARDS={'b': 'shard1', 'c': 'shard2'})
+class ShardingTest(TestCase):
+    databases = {'default', 'shard1', 'shard2'}
+
+    def setUp(self):
+        self.b = Board.objects.create(name='b')
+        self.c = Board.objects.create(name='c')
+
+    def new_thread(self, board, comment):
+        self.client.post(reverse('djangoboard:new_thread'), {'comment': comment, 'board': board})
+        return Thread.objects.using(sharding.shard_for_board(board)).get(comment=comment)
+
+    def new_post(self, thread, comment):
+        self.client.post(reverse('djangoboard:new_post'), {'comment': comment, 'thread': thread.id})
+        return Post.objects.using(thread._state.db).get(comment=comment)
+
+    def test_placement(self):
+        thread = self.new_thread('b', 'thread on b')
+        post = self.new_post(thread, 'post on b')
+        self.assertEqual((thread._state.db, post._state.db), ('shard1', 'shard1'))
+        self.assertEqual((thread.id % 3, post.id % 3), (1, 1))
+        self.assertFalse(Thread.objects.exists())
+        self.assertEqual(self.new_thread('c', 'thread on c').id % 3, 2)
+        self.assertEqual(self.new_post(thread, 'another post on b').id, post.id + 3)
+
+        self.b.refresh_from_db()
+        self.assertEqual(self.b.post_count, 3)
+
+    def test_views(self):
+        thread = self.new_thread('b', 'thread on b')
+        post = self.new_post(thread, 'post on b')
+        self.assertContains(self.client.get(reverse('djangoboard:board', args=['b'])), 'post on b')
+        self.assertIn(b'post on b', self.client.get(reverse('djangoboard:thread', args=[thread.id])).getvalue())
+        self.assertRedirects(self.client.get(reverse('djangoboard:post', args=[post.id])),
+                             '%s#%i' % (reverse('djangoboard:thread', args=[thread.id]), post.id),
+                             fetch_redirect_response=False)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_thread', args=[thread.id])).json()['posts'][0]['id'],
+                         post.id)
+        self.assertEqual(self.client.get(reverse('djangoboard:board', args=['c'])).status_code, 200)
+
+    def test_cross_board_links(self):
+        thread = self.new_thread('b', 'thread on b')
+        post = self.new_post(thread, 'post on b')
+        other = self.new_thread('c', 'thread on c')
+        self.new_post(other, '>>%i from c' % post.id)
+        response = self.client.get(reverse('djangoboard:thread', args=[other.id]))
+        self.assertIn(('href="%s#%i"' % (reverse('djangoboard:thread', args=[thread.id]), post.id)).encode(),
+                      response.getvalue())
+
+    def test_published_once_the_shard_commits(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with override_settings(DJANGOBOARD_STATIC_EXPORT_ROOT=root):
+            with self.captureOnCommitCallbacks(using='shard1', execute=True):
+                thread = self.new_thread('b', 'thread on b')
+                self.assertFalse(os.path.exists(os.path.join(root, 'b')))
+            with open(os.path.join(root, 'thread', str(thread.id), 'index.html')) as f:
+                self.assertIn('thread on b', f.read())
+
+    def test_board_copies(self):
+        self.assertTrue(Board.objects.using('shard2').filter(name='c').exists())
+        self.new_thread('c', 'thread on c')
+        self.c.delete()
+        self.assertFalse(Board.objects.using('shard2').filter(name='c').exists())
+        self.assertFalse(Thread.objects.using('shard2').exists())
+
+    def test_admin(self):
+        self.client.force_login(User.objects.create_superuser('admin'))
+        post = self.new_post(self.new_thread('b', 'thread on b'), 'post on b')
+        response = self.client.get(reverse('admin:djangoboard_post_change', args=[post.id]))
+        self.assertContains(response, 'post on b')
+        self.assertContains(self.client.get(reverse('admin:djangoboard_post_changelist') + '?shard=shard1'),
+                            'post on b')
+
+
+@override_settings(DJANGOBOARD_REQUIRE_CAPTCHA=False, DJANGOBOARD_REPLICAS={'default': ['replica1']})
+class ReplicaTest(TestCase):
+    # in tests, replica1 is a second connection to the default database, which doesn't see
+    # what the test case hasn't committed: a replica lagging behind
+    databases = {'default', 'replica1'}
+
+    def setUp(self):
+        self.board = Board.objects.create(name='b')
+
+    def test_reads_from_replica(self):
+        self.assertEqual(self.client.get(reverse('djangoboard:board', args=['b'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_catalog', args=['b'])).status_code, 404)
+        self.assertEqual(self.client.get(reverse('djangoboard:api_boards')).json(), [])
+
+    def test_read_your_writes(self):
+        self.client.post(reverse('djangoboard:new_thread'), {'comment': 'regular thread', 'board': 'b'})
+        thread = Thread.objects.get(comment='regular thread')
+        self.assertContains(self.client.get(reverse('djangoboard:board', args=['b'])), 'regular thread')
+        self.assertIn(b'regular thread', self.client.get(reverse('djangoboard:thread', args=[thread.id])).getvalue())
+        self.assertEqual(Client().get(reverse('djangoboard:thread', args=[thread.id])).status_code, 404)
+
+    def test_writes_to_primary(self):
+        thread = Thread.objects.create(board=self.board, comment='regular thread')
+        thread._state.db = 'replica1'  # as if read from the replica
+        thread.comment = 'edited thread'
+        thread.save()
+        self.assertTrue(Thread.objects.filter(comment='edited thread').exists())
+
+
+class SQLiteTest(TestCase):
+    def test_pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+
+@override_settings(DJANGOBOARD_REQUIRE_CAPTCHA=False, DJANGOBOARD_SERIALIZED_WRITES=True)
+class ConcurrentPostingTest(TransactionTestCase):
+    databases = {'default', 'shard1', 'shard2'}
+    clients = 8
+    posts_per_client = 10
+
+    def test_burst(self):
+        self.burst()
+
+    @override_settings(DJANGOBOARD_SERIALIZED_WRITES=False,  # like separate processes
+                       DJANGOBOARD_SHARDS=['default', 'shard1', 'shard2'],
+                       DJANGOBOARD_BOARD_SHARDS={'mock': 'shard1'})
+    def test_burst_sharded(self):
+        self.burst()
+
+    @override_settings(DJANGOBOARD_SERIALIZED_WRITES=True)
+    def test_worker_connections(self):
+        worker = Worker('DJANGOBOARD_SERIALIZED_WRITES')
+        self.addCleanup(worker.executor.shutdown)
+        self.assertEqual(worker.run(Board.objects.count), 0)
+        self.assertIsNone(worker.run(lambda: connection.connection))  # closed after the last job
+
+    def burst(self):
+        board = Board.objects.create(name='mock')
+        thread = Thread.objects.create(board=board, comment='mock')
+        failures = []
+
+        def post(n):
+            client = Client()
+            try:
+                for i in range(self.posts_per_client):
+                    response = client.post(reverse('djangoboard:new_post'),
+                                           {'comment': 'post %i.%i' % (n, i), 'thread': thread.id})
+                    if response.status_code != 302:
+                        failures.append(response.status_code)
+            except Exception as e:
+                failures.append(e)
+            finally:
+                connections.close_all()
+
+        clients = [threading.Thread(target=post, args=[n]) for n in range(self.clients)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+
+        self.assertListEqual(failures, [])
+        self.assertEqual(Post.objects.using(thread._state.db).filter(thread=thread).count(),
+                         self.clients * self.posts_per_client)
+
+
+class CollectOrphansTest(TempMediaRootMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        image = io.BytesIO()
+        Image.new('RGB', (300, 200), 'orange').save(image, 'PNG')
+        self.thread = Thread.objects.create(board=Board.objects.create(name='b'), comment='test thread')
+        self.kept = Attachment.objects.create(post=self.thread, mime='image/png',
+                                              file=SimpleUploadedFile('kept.png', image.getvalue()))
+        self.orphan = Attachment.objects.create(post=self.thread, mime='image/png',
+                                                file=SimpleUploadedFile('orphan.png', image.getvalue()))
+        for attachment in (self.kept, self.orphan):
+            get_thumbnailer(attachment.file).get_thumbnail({'size': (100, 100), 'crop': True})
+        self.orphan.delete()
+
+    def files(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'uploads')))
+
+    def collect(self, *args):
+        out = io.StringIO()
+        call_command('collect_orphans', '--min-age', '0', '--rate', '0', *args, stdout=out)
+        return out.getvalue()
+
+    def test_dry_run(self):
+        files = self.files()
+        self.assertIn('Found 2 orphaned files', self.collect('--dry-run'))
+        self.assertEqual(self.files(), files)
+
+    def test_collect(self):
+        self.assertIn('Deleted 2 orphaned files', self.collect('--batch-size', '1'))
+        self.assertEqual(len(self.files()), 2)
+        self.assertTrue(all(name.startswith('kept.png') for name in self.files()))
+        self.assertFalse(Source.objects.filter(name='uploads/orphan.png').exists())
+        self.assertTrue(Source.objects.filter(name='uploads/kept.png').exists())
+
+    def test_derivatives(self):
+        Attachment.objects.filter(id=self.kept.id).update(variants='webp')
+        storage = self.kept.file.storage
+        storage.save(self.kept.file.name + '.webp', ContentFile(b'variant'))
+        deleted = Attachment.objects.create(post=self.thread, mime='text/html',
+                                            file=SimpleUploadedFile('kept.png.html', b'<script>'))
+        deleted.delete()
+        self.assertIn('Deleted 3 orphaned files', self.collect())
+        self.assertIn('kept.png.webp', self.files())
+        self.assertNotIn('kept.png.html', self.files())
+
+    def test_recent_files_kept(self):
+        self.assertIn('Deleted 0 orphaned files', self.collect('--min-age', '3600'))
+
+
+@override_settings(DJANGOBOARD_REQUIRE_CAPTCHA=False)
+class StaticPublishingTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        publishing = override_settings(DJANGOBOARD_STATIC_EXPORT_ROOT=self.root)
+        publishing.enable()
+        self.addCleanup(publishing.disable)
+
+        self.board = Board.objects.create(name='b')
+        self.thread = Thread.objects.create(board=self.board, comment='test thread')
+
+    def read(self, *path):
+        with open(os.path.join(self.root, *path, 'index.html')) as f:
+            return f.read()
+
+    def test_export(self):
+        Post.objects.create(thread=self.thread, comment='regular post')
+        call_command('export_static', stdout=open(os.devnull, 'w'))
+        self.assertIn('/b/', self.read())
+        self.assertIn('test thread', self.read('b'))
+        self.assertIn('regular post', self.read('thread', str(self.thread.id)))
+
+    def test_regenerated_on_post(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('djangoboard:new_post'), {'comment': 'regular post', 'thread': self.thread.id})
+        self.assertIn('regular post', self.read('thread', str(self.thread.id)))
+        self.assertIn('regular post', self.read('b'))
+
+    def test_home_page_regenerated(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('djangoboard:new_post'), {'comment': 'regular post', 'thread': self.thread.id})
+        self.assertRegex(self.read(), r'1 thread,\s+2 posts,')
+
+        # the deletions are uncounted after the commit, then the page is regenerated after that
+        with self.captureOnCommitCallbacks(execute=True), self.captureOnCommitCallbacks(execute=True):
+            self.thread.delete()
+        self.assertRegex(self.read(), r'0 threads,\s+0 posts,')
+
+    def test_removed_on_delete(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.create(thread=self.thread, comment='regular post')
+        self.assertIn('regular post', self.read('thread', str(self.thread.id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertNotIn('regular post', self.read('thread', str(self.thread.id)))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.thread.delete()
+        self.assertFalse(os.path.exists(os.path.join(self.root, 'thread', str(self.thread.id), 'index.html')))
+        self.assertNotIn('test thread', self.read('b'))
@@ -1,16 +1,25 @@
 from django.conf import settings
 from django.conf.urls.static import static
 from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
 from django.views.generic.base import TemplateView
 
-from . import views
+from . import api, media, views
 
 app_name = 'djangoboard'
+
+
+def static_publishing(view):
+    # Statically published pages are the same for everybody, so the CSRF tokens in their forms can't
+    # match the visitors' cookies. Posting is still guarded by the captcha session.
+    return csrf_exempt(view) if settings.DJANGOBOARD_STATIC_EXPORT_ROOT else view
+
+
 urlpatterns = [
     path('', views.HomePageView.as_view(), name='homepage'),
 
-    path('new_post', views.CreatePostView.as_view(), name='new_post'),
-    path('new_thread', views.CreateThreadView.as_view(), name='new_thread'),
+    path('new_post', static_publishing(views.CreatePostView.as_view()), name='new_post'),
+    path('new_thread', static_publishing(views.CreateThreadView.as_view()), name='new_thread'),
 
     path('post/<int:post_id>', views.post, name='post'),
     path('thread/<int:thread_id>', views.thread, name='thread'),
@@ -21,11 +30,18 @@ urlpatterns = [
     path('profile', views.profile, name='profile'),
     path('delete', views.delete, name='delete'),
 
+    path('api/boards', api.boards, name='api_boards'),
+    path('api/thread/<int:thread_id>', api.thread, name='api_thread'),
+    path('api/<str:boardname>/catalog', api.catalog, name='api_catalog'),
+    path('api/<str:boardname>/<int:page>', api.board, name='api_board'),
+
+    path('files/<int:object_id>/<str:digest>/<path:name>', media.serve, name='media'),
+
     path('help', TemplateView.as_view(template_name="djangoboard/help.html"), name='help'),
     path('success', TemplateView.as_view(template_name="djangoboard/success.html"), name='success'),
 
     path('<str:boardname>', views.board, name='board'),
 
 ]
-if settings.DEBUG:  # otherwise should be configured using server software
+if settings.DEBUG:  # uploads without a digest, otherwise should be configured using server software
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -1,7 +1,17 @@
+import hashlib
+from datetime import datetime
+
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Count, Max
 from django.http import HttpRequest
 from django.shortcuts import redirect
 from django.urls import reverse
+from django.views.decorators.http import condition
+
+from .models import *
+from .replicas import replica_of
+from .sharding import shard_of
 
 
 def human_required(view_function):
@@ -12,3 +22,61 @@ def human_required(view_function):
             return redirect(reverse('djangoboard:captcha'))
 
     return wrapper
+
+
+def board_state(boardname, **kwargs):
+    """
+    Everything a board's pages depend on, from the counters djangoboard.stats maintains on the board;
+    None if there is no such board.
+    """
+    # posting and deleting change the counts or the last activity, processing images the version,
+    # so the board's posts are never scanned
+    return Board.objects.using(replica_of(DEFAULT_DB_ALIAS)).filter(name=boardname) \
+        .values('name', 'short_description', 'description', 'thread_count', 'post_count', 'last_activity',
+                'version') \
+        .first()
+
+
+def thread_state(thread_id, **kwargs):
+    """Everything a thread's pages depend on, in one aggregate query; None if there is no such thread."""
+    return Thread.objects.using(replica_of(shard_of(thread_id))).filter(id=thread_id) \
+        .values('id', 'board', 'date', 'version') \
+        .annotate(num_replies=Count('posts', distinct=True),
+                  last_post=Max('posts__id'),
+                  bumped=Max('posts__date'),
+                  # the replies listed under the posts, which may come from other threads
+                  num_backlinks=Count('posts__replies'),
+                  last_backlink=Max('posts__replies__id')) \
+        .first()
+
+
+def conditional(state_function, variant=None):
+    """
+    Answers conditional GETs with 304 before the view runs.
+
+    `state_function` is called with the view's URL keyword arguments and returns a dict of
+    everything the response depends on, or None when the resource doesn't exist (the view
+    then runs and 404s). `variant(request, state)` returns the per-user parts of the response.
+    """
+
+    def state(request, **kwargs):
+        if not hasattr(request, 'djangoboard_state'):
+            request.djangoboard_state = state_function(**kwargs)
+        return request.djangoboard_state
+
+    def etag(request, *args, **kwargs):
+        state_ = state(request, **kwargs)
+        if state_ is None:
+            return None
+        validator = [state_[key] for key in sorted(state_)]
+        if variant is not None:
+            validator.append(variant(request, state_))
+        return hashlib.sha1(repr(validator).encode()).hexdigest()
+
+    def last_modified(request, *args, **kwargs):
+        state_ = state(request, **kwargs)
+        if state_ is None:
+            return None
+        return max((value for value in state_.values() if isinstance(value, datetime)), default=None)
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
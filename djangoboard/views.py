@@ -1,85 +1,146 @@
-import guardian
+from itertools import chain, islice
+
 from django.conf import settings
 from django.contrib.auth.decorators import login_required
-from django.db.models import Count, Prefetch, Max, Subquery, OuterRef, Case, When
-from django.http import HttpRequest, HttpResponseBadRequest, HttpResponseForbidden, HttpResponse
+from django.db import router, transaction
+from django.db.models import Prefetch
+from django.http import HttpRequest, HttpResponseBadRequest, HttpResponseForbidden, HttpResponse, \
+    HttpResponseRedirect, StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import get_template, render_to_string
 from django.urls import reverse
 from django.utils.decorators import method_decorator
+from django.utils.safestring import mark_safe
 from django.views.generic import CreateView, ListView
 
-from djangoboard.utils import human_required
+from djangoboard import stats
+from djangoboard.permissions import can_moderate, moderated_boards
+from djangoboard.rendering import PostListRenderer
+from djangoboard.replicas import replica_of, wrote
+from djangoboard.rows import PostRow, post_rows
+from djangoboard.sharding import shard_for_board, shard_of
+from djangoboard.templatetags.postmarkup import PostLinks, Urls
+from djangoboard.utils import human_required, conditional, board_state, thread_state
+from djangoboard.workers import writer
 from .forms import *
 from .models import *
 
 
+class SerializedWriteMixin:
+    """Saves the form on the writer thread instead of competing with other requests for the write lock."""
+
+    def form_valid(self, form):
+        self.object = writer.run(self.save, form)
+        return wrote(HttpResponseRedirect(self.get_success_url()))
+
+    @staticmethod
+    def save(form):
+        # atomic, so the post is published together with its attachments and replies
+        with transaction.atomic(using=router.db_for_write(form._meta.model, instance=form.instance)):
+            return form.save()
+
+
 @method_decorator(human_required, name='dispatch')
-class CreatePostView(CreateView):
+class CreatePostView(SerializedWriteMixin, CreateView):
     template_name = 'djangoboard/post_form.html'
     form_class = PostForm
 
 
 @method_decorator(human_required, name='dispatch')
-class CreateThreadView(CreateView):
+class CreateThreadView(SerializedWriteMixin, CreateView):
     template_name = 'djangoboard/thread_form.html'
     form_class = ThreadForm
 
 
 class HomePageView(ListView):
     template_name = 'djangoboard/home.html'
-    model = Board
 
+    def get_queryset(self):
+        return stats.boards()
+
+
+def page_variant(request: HttpRequest, state):
+    # the username and the CSRF token of the forms are rendered into every page
+    return request.user.pk, request.COOKIES.get(settings.CSRF_COOKIE_NAME)
+
+
+def thread_variant(request: HttpRequest, state):
+    return page_variant(request, state) + (can_moderate(request.user, state['board']),)
 
+
+@conditional(board_state, page_variant)
 def board(request: HttpRequest, boardname: str):
-    board_ = get_object_or_404(Board, name=boardname)
-    query = Thread.objects.filter(board=board_).annotate(num_replies=Count('posts')) \
-        .annotate(last_bumped=Case(
-            When(num_replies=0, then='date'),
-            When(num_replies__gt=0, then=Max('posts__date')))) \
-        .order_by('-last_bumped') \
+    board_ = get_object_or_404(Board.objects.using(replica_of(shard_for_board(boardname))), name=boardname)
+    query = Thread.objects.using(board_._state.db).filter(board=board_).bumped() \
         .prefetch_related(Prefetch('posts',
                                    # Only a few of the latest posts need to be displayed
-                                   queryset=Post.objects.filter(
-                                       id__in=
-                                       Subquery(
-                                           Post.objects.filter(
-                                               thread_id=OuterRef('thread_id')
-                                           ).values_list('id', flat=True)[:settings.DJANGOBOARD_POSTS_PREVIEWED])
-                                   )
-                                   ),
+                                   queryset=Post.objects.previewed()),
                           'attachments',
                           'posts__attachments'
                           )
+    comments = [thread_.comment for thread_ in query] + \
+               [post_.comment for thread_ in query for post_ in thread_.posts.all()]
 
     return render(request, 'djangoboard/board.html',
                   {'board': board_,
                    'threads': query,
+                   'post_links': PostLinks.resolve(comments),
                    'form': ThreadForm(initial={'board': boardname, }),
                    },
                   )
 
 
 def post(request: HttpRequest, post_id):
-    post_ = get_object_or_404(Post, id=post_id)
+    post_ = get_object_or_404(Post.objects.using(replica_of(shard_of(post_id))), id=post_id)
     return redirect("%s#%s" % (reverse('djangoboard:thread', args=[post_.thread.id]), post_.id))
 
 
+POST_LIST_MARKER = mark_safe('<!-- post list -->')
+
+
+def post_list(thread_id, moderation, using):
+    """Renders the posts of a thread chunk by chunk, fetching attachments and replies of one chunk at a time."""
+    urls = Urls()
+    if settings.DJANGOBOARD_FAST_POST_LIST:
+        render_chunk = PostListRenderer(urls).render
+    else:
+        template = get_template('djangoboard/post_list_snippet.html')
+
+        def render_chunk(posts, post_links, moderation):
+            return template.render({'posts': posts, 'post_links': post_links, 'moderation': moderation})
+
+    values = Post.objects.using(using).filter(thread_id=thread_id).values_list(*PostRow.fields) \
+        .iterator(chunk_size=settings.DJANGOBOARD_THREAD_CHUNK_SIZE)
+    while True:
+        chunk, reply_threads = post_rows(islice(values, settings.DJANGOBOARD_THREAD_CHUNK_SIZE), using)
+        if not chunk:
+            break
+        reply_threads.update((post_.id, post_.thread_id) for post_ in chunk)
+        post_links = PostLinks.resolve([post_.comment for post_ in chunk], thread_id, reply_threads, urls)
+        yield render_chunk(chunk, post_links, moderation)
+
+
+@conditional(thread_state, thread_variant)
 def thread(request: HttpRequest, thread_id, replying_to=None):
-    thread_ = get_object_or_404(Thread, id=thread_id)
-    posts = Post.objects.filter(thread=thread_).prefetch_related('attachments')
+    thread_ = get_object_or_404(Thread.objects.using(replica_of(shard_of(thread_id))).select_related('board'),
+                                id=thread_id)
     board_ = thread_.board
-    return render(request, 'djangoboard/thread.html',
-                  {'form': PostForm(
-                      initial={
-                          'thread': thread_id,
-                          'comment': '' if replying_to is None else '>>%i' % replying_to
-                      }),
-                      'thread': thread_,
-                      'board': board_,
-                      'posts': posts,
-                      'displayed_post_ids': posts.values_list('id', flat=True),
-                      'moderation': request.user.has_perm('delete_posts', board)}
-                  )
+    moderation = can_moderate(request.user, board_.name)
+    page = render_to_string('djangoboard/thread.html',
+                            {'form': PostForm(
+                                initial={
+                                    'thread': thread_id,
+                                    'comment': '' if replying_to is None else '>>%i' % replying_to
+                                }),
+                                'thread': thread_,
+                                'board': board_,
+                                'post_list': POST_LIST_MARKER,
+                                'post_links': PostLinks.resolve([thread_.comment], thread_.id),
+                                'moderation': moderation},
+                            request)
+    # the header and the opening post are sent right away, the posts as they are rendered
+    head, tail = page.split(POST_LIST_MARKER)
+    return StreamingHttpResponse(chain([head], post_list(thread_.id, moderation, thread_._state.db), [tail]))
 
 
 def captcha(request: HttpRequest):
@@ -99,8 +160,7 @@ def captcha(request: HttpRequest):
 
 @login_required
 def profile(request: HttpRequest):
-    moderated_boards = guardian.shortcuts.get_objects_for_user(request.user, 'delete_posts', Board)
-    return render(request, 'djangoboard/profile.html', {'moderated_boards': moderated_boards})
+    return render(request, 'djangoboard/profile.html', {'moderated_boards': sorted(moderated_boards(request.user))})
 
 
 @login_required
@@ -111,8 +171,9 @@ def delete(request: HttpRequest):
     if not board:
         return HttpResponseBadRequest()
 
-    if not request.user.has_perm('delete_posts', board):
+    if not can_moderate(request.user, board):
         return HttpResponseForbidden()
-    Post.objects.filter(thread__in=Thread.objects.filter(board=board),
-                        id__in=filter(lambda x: x.isdigit(), request.POST.keys())).delete()
+    Post.objects.using(shard_for_board(board)).filter(thread__board=board,
+                                                      id__in=filter(lambda x: x.isdigit(), request.POST.keys())) \
+        .delete()
     return HttpResponse("Success")
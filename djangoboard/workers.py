@@ -0,0 +1,63 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+__all__ = ['Worker', 'writer']
+
+
+class Worker:
+    """
+    Runs jobs on a pool of background threads of this process.
+
+    Threads are long-lived and have their own database connections, which are closed around
+    every job as around every request: when broken or older than CONN_MAX_AGE. While the `setting`
+    named on creation is false, or when the caller is inside a transaction (whose uncommitted
+    rows other connections cannot see), jobs run synchronously in the caller's thread instead.
+    """
+
+    def __init__(self, setting, max_workers=1):
+        self.setting = setting
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return getattr(settings, self.setting)
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix=self.setting.lower())
+            return self._executor
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        if self.enabled and not connection.in_atomic_block:
+            return self.executor.submit(self._job, function, *args, **kwargs)
+        future = Future()
+        try:
+            future.set_result(function(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    @staticmethod
+    def _job(function, *args, **kwargs):
+        close_old_connections()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    def run(self, function, *args, **kwargs):
+        """Waits for the job and returns its result (or raises its exception)."""
+        return self.submit(function, *args, **kwargs).result()
+
+
+# A single thread performing every post and thread creation of the process, so that bursts
+# of posting queue up here rather than contend for the SQLite write lock.
+writer = Worker('DJANGOBOARD_SERIALIZED_WRITES')